@@ -1,26 +1,1561 @@
 #!/usr/bin/env python3
+import os
+import stat
 import time
+import logging
 import sys
+import random
+import threading
+import collections
+import hashlib
+import calendar
+import re
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from array import array
 import requests
 import json
-# WEBSOCKET = True
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+WEBSOCKET = True
 
 try:
     import polyinterface
 except ImportError:
     import pgc_interface as polyinterface
 
-# try:
-#     import asyncio
-#     from aiohttp import ClientSession
-#     from aioambient import Client
-#     from aioambient.errors import WebsocketError
-# except ImportError:
-#     WEBSOCKET = False
+try:
+    import asyncio
+    import aioambient.websocket
+    from aioambient import Websocket
+    from aioambient.errors import WebsocketError
+except ImportError:
+    WEBSOCKET = False
 
 
 LOGGER = polyinterface.LOGGER
 
+# Override with the 'api_url' custom parameter, e.g. to point at bench/simulator.py
+API_BASE = 'https://api.ambientweather.net'
+# (connect, read) timeouts in seconds for every call to the Ambient API
+HTTP_TIMEOUT = (5, 15)
+HTTP_RETRIES = 2
+HTTP_POOL_SIZE = 4
+# Accounts fetched at the same time when several API keys are configured
+ACCOUNT_WORKERS = 4
+
+# Seconds a poll cycle may spend on the Ambient API, retries included
+POLL_DEADLINE = 45
+# Most cycles waiting for the API worker
+WORKER_QUEUE = 4
+
+# Ambient allows about one request per second per API key
+API_RATE = 1.0
+API_BURST = 1
+# and three per second per application key, shared by every API key using it
+APP_RATE = 3.0
+APP_BURST = 1
+API_RETRIES = 4
+API_BACKOFF_BASE = 1.0
+API_BACKOFF_MAX = 60
+
+# Consecutive failed API calls that open the circuit breaker, and the
+# range of seconds between probes while it is open
+BREAKER_FAILURES = 5
+BREAKER_PROBE_MIN = 30
+BREAKER_PROBE_MAX = 900
+
+# Websocket reconnect backoff in seconds
+WS_BACKOFF_MIN = 5
+WS_BACKOFF_MAX = 300
+
+class RateLimiter(object):
+    # Token bucket per key (API key, or application key for the separate
+    # per-application limit) shared by every caller of the Ambient API, so
+    # discovery, polling and operator commands never exceed the key's budget.
+    # A 429 blocks the key until Retry-After (or a jittered exponential
+    # backoff) has passed, never longer than API_BACKOFF_MAX.
+    def __init__(self, rate=API_RATE, burst=API_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.throttled = 0
+        self.retried = 0
+        self.waited = 0.0
+
+    def acquire(self, key, deadline=None):
+        # deadline (monotonic time): raise RateLimitTimeout rather than wait past it
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens, stamp, blocked_until = self.buckets.get(key, (self.burst, now, 0))
+                tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+                if now >= blocked_until and tokens >= 1:
+                    self.buckets[key] = (tokens - 1, now, blocked_until)
+                    return
+                self.buckets[key] = (tokens, now, blocked_until)
+                wait = max(blocked_until - now, (1 - tokens) / self.rate)
+                if deadline is not None and now + wait >= deadline:
+                    raise RateLimitTimeout('Ambient API rate limit wait of {:.1f}s would pass the deadline'.format(wait))
+                self.waited += wait
+            time.sleep(wait)
+
+    def backoff(self, key, attempt, retry_after=None):
+        # Block the key after a 429/503 and return the delay that was applied
+        if retry_after is None:
+            delay = min(API_BACKOFF_MAX, API_BACKOFF_BASE * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+        else:
+            delay = min(API_BACKOFF_MAX, retry_after)
+        with self.lock:
+            now = time.monotonic()
+            tokens, stamp, blocked_until = self.buckets.get(key, (0, now, 0))
+            self.buckets[key] = (0, now, max(blocked_until, now + delay))
+        return delay
+
+    @staticmethod
+    def retry_after(response):
+        value = response.headers.get('Retry-After')
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self):
+        return {'throttled': self.throttled, 'retried': self.retried, 'waited': round(self.waited, 1)}
+
+
+# Records kept by the in-memory debug trace
+TRACE_SIZE = 2000
+# Seconds between repeats of a rate-limited log message
+LOG_INTERVAL = 3600
+
+
+class DebugTrace(object):
+    # Fixed-size in-memory ring of verbose trace records.  Only the format
+    # string and arguments are kept; nothing is formatted or written to the
+    # log until an operator dumps it with the DUMP_TRACE command.
+    def __init__(self, size=TRACE_SIZE):
+        self.records = collections.deque(maxlen=size)
+
+    def __call__(self, msg, *args):
+        self.records.append((time.time(), msg, args))
+
+    def dump(self):
+        for stamp, msg, args in list(self.records):
+            yield time.strftime('%H:%M:%S ', time.localtime(stamp)) + (msg % args)
+
+
+class LogLimiter(object):
+    # Logs the first message for a key, then at most one per interval with
+    # a count of the ones held back in between.
+    def __init__(self, interval=LOG_INTERVAL):
+        self.interval = interval
+        self.last = {}
+        self.held = collections.Counter()
+
+    def log(self, key, level, msg, *args):
+        now = time.monotonic()
+        last = self.last.get(key)
+        if last is not None and now - last < self.interval:
+            self.held[key] += 1
+            return False
+        self.last[key] = now
+        held = self.held.pop(key, 0)
+        if held:
+            msg += ' (%d more since last logged)'
+            args += (held,)
+        LOGGER.log(level, msg, *args)
+        return True
+
+
+class ApiWorker(object):
+    # Runs Ambient API cycles (polls, discovery) on one dedicated thread so
+    # Polyglot's timer and command threads never wait on the network.  The
+    # queue holds at most one cycle per name and resubmitting a waiting one
+    # replaces it (latest wins); a cycle submitted while the same one is
+    # still running is skipped and counted instead of piling up.
+    def __init__(self, size=WORKER_QUEUE, log=None):
+        self.size = size
+        self.log = log or LogLimiter()
+        self.jobs = collections.OrderedDict()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = None
+        self.stopped = False
+        self.skipped = collections.Counter()
+        self.dropped = 0
+
+    def submit(self, name, job, deadline=None):
+        # deadline is in seconds; the job receives it as a monotonic time
+        with self.cond:
+            if self.stopped:
+                return False
+            if name == self.running:
+                self.skipped[name] += 1
+                self.log.log(name + '_skipped', logging.WARNING, 'Previous %s cycle still running, skipped', name)
+                return False
+            self.jobs.pop(name, None)
+            if len(self.jobs) >= self.size:
+                self.jobs.popitem(last=False)
+                self.dropped += 1
+            self.jobs[name] = (job, deadline)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='AmbientApiWorker')
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.jobs and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    break
+                name, (job, deadline) = self.jobs.popitem(last=False)
+                self.running = name
+            try:
+                if deadline is None:
+                    job()
+                else:
+                    job(time.monotonic() + deadline)
+            except Exception as e:
+                LOGGER.error('Ambient %s cycle failed: %s', name, e)
+            finally:
+                with self.cond:
+                    self.running = None
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.jobs.clear()
+            self.cond.notify()
+
+    def stats(self):
+        return {'skipped': dict(self.skipped), 'dropped': self.dropped}
+
+
+class ApiUnavailable(requests.exceptions.RequestException):
+    # Raised instead of calling the API while the circuit breaker is open
+    pass
+
+
+class RateLimitTimeout(requests.exceptions.Timeout):
+    # Raised when waiting for the rate limiter would pass the cycle deadline
+    pass
+
+
+class CircuitBreaker(object):
+    # Stops calling the Ambient API after BREAKER_FAILURES consecutive
+    # failures.  While open a single probe is let through at increasing
+    # intervals; the first success closes it again.  on_change(open) is
+    # called on every transition so the ISY can show the data is stale.
+    def __init__(self, failures=BREAKER_FAILURES, probe_min=BREAKER_PROBE_MIN,
+                 probe_max=BREAKER_PROBE_MAX, on_change=None):
+        self.failures = failures
+        self.probe_min = probe_min
+        self.probe_max = probe_max
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.failed = 0
+        self.open = False
+        self.interval = probe_min
+        self.next_probe = 0
+        self.probing = False
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self):
+        with self.lock:
+            if not self.open:
+                return True
+            now = time.monotonic()
+            if self.probing or now < self.next_probe:
+                self.rejected += 1
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        # The call never reached the API: no verdict, let the next probe through
+        with self.lock:
+            self.probing = False
+
+    def success(self):
+        with self.lock:
+            self.failed = 0
+            self.probing = False
+            if not self.open:
+                return
+            self.open = False
+            self.interval = self.probe_min
+        LOGGER.warning('Ambient API is answering again, circuit breaker closed')
+        if self.on_change is not None:
+            self.on_change(False)
+
+    def failure(self):
+        with self.lock:
+            self.failed += 1
+            if self.open:
+                # Failed probe: wait longer before the next one
+                self.probing = False
+                self.interval = min(self.interval * 2, self.probe_max)
+                self.next_probe = time.monotonic() + self.interval
+                return
+            if self.failed < self.failures:
+                return
+            self.open = True
+            self.opened += 1
+            self.interval = self.probe_min
+            self.next_probe = time.monotonic() + self.interval
+        LOGGER.warning('Ambient API failed %d times in a row, circuit breaker open; probing every %d-%d seconds',
+                       self.failures, self.probe_min, self.probe_max)
+        if self.on_change is not None:
+            self.on_change(True)
+
+    def stats(self):
+        return {'open': self.open, 'failed': self.failed, 'opened': self.opened, 'rejected': self.rejected}
+
+
+# Smallest change, by driver uom, worth republishing to the ISY.  Anything
+# not listed is republished on any change.  Override with the 'deadbands'
+# custom parameter, e.g. "17=0.2, 23=0.02".
+DEADBANDS = {
+    17: 0.1,   # degrees F
+    22: 1,     # relative humidity %
+    23: 0.01,  # inHg
+    36: 10,    # lux
+    42: 10,    # milliseconds
+    48: 0.1,   # mph
+    74: 1,     # W/m2
+    76: 1,     # wind direction degrees
+    105: 0.01,  # inches of rain
+}
+
+
+# Most nodes flushed to Polyglot per dispatch cycle; the rest wait for the
+# next flush with their latest values.
+FLUSH_LIMIT = 250
+
+
+class DriverPublisher(object):
+    # Remembers the last value published per (node, driver) and only queues
+    # a driver when a reading moves by at least the driver's deadband.  Queued
+    # changes are sent by flush() at the end of a dispatch cycle, one
+    # setDriver (one Polyglot message) per changed driver; reportDrivers()
+    # would resend every driver of the node, changed or not.
+    def __init__(self, deadbands, flush_limit=FLUSH_LIMIT, trace=None):
+        self.deadbands = dict(deadbands)
+        self.flush_limit = flush_limit
+        self.trace = trace
+        self.published = {}
+        self.pending = {}
+        self.uoms = {}
+        self.suppressed = 0
+        self.messages = 0
+
+    def deadband(self, node, driver):
+        key = (node.id, driver)
+        uom = self.uoms.get(key)
+        if uom is None:
+            uom = next((d['uom'] for d in node.drivers if d['driver'] == driver), 0)
+            self.uoms[key] = uom
+        return self.deadbands.get(uom, 0)
+
+    def changed(self, node, driver, value):
+        last = self.published.get((node.address, driver))
+        if last is None:
+            return True
+        deadband = self.deadband(node, driver)
+        try:
+            if not deadband:
+                return float(value) != float(last)
+            return abs(float(value) - float(last)) + 1e-9 >= deadband
+        except (TypeError, ValueError):
+            return value != last
+
+    def publish(self, node, driver, value):
+        if not self.changed(node, driver, value):
+            self.suppressed += 1
+            return False
+        self.published[(node.address, driver)] = value
+        if self.trace is not None:
+            self.trace('%s %s = %s', node.address, driver, value)
+        entry = self.pending.get(node.address)
+        if entry is None:
+            entry = self.pending[node.address] = (node, {})
+        entry[1][driver] = value
+        return True
+
+    def flush(self):
+        sent = 0
+        while self.pending and sent < self.flush_limit:
+            address = next(iter(self.pending))
+            node, changes = self.pending.pop(address)
+            for driver, value in changes.items():
+                node.setDriver(driver, value)
+            sent += 1
+            self.messages += len(changes)
+        if self.pending:
+            LOGGER.debug('Flush limit reached, %d nodes deferred', len(self.pending))
+        return sent
+
+    def forget(self, address=None):
+        if address is None:
+            self.published.clear()
+            self.pending.clear()
+        else:
+            self.pending.pop(address, None)
+            for key in [k for k in self.published if k[0] == address]:
+                del self.published[key]
+
+    @staticmethod
+    def parse_deadbands(text):
+        deadbands = {}
+        for item in text.split(','):
+            if '=' not in item:
+                continue
+            uom, value = item.split('=', 1)
+            try:
+                deadbands[int(uom)] = float(value)
+            except ValueError:
+                LOGGER.error('Ignoring bad deadband: %s', item.strip())
+        return deadbands
+
+
+# Upload intervals, in seconds, that Ambient stations report at
+UPLOAD_CADENCES = (60, 300)
+# Seconds after an expected upload before fetching, to let the cloud catch up
+POLL_MARGIN = 10
+# Never arm the poll timer closer than this many seconds
+POLL_MIN_DELAY = 5
+# Seconds between polls while stations push readings that lack fields with
+# nodes, such as the feels like and dew point only the cloud computes
+POLL_FILL_INTERVAL = 300
+
+
+def epoch_seconds(dateutc):
+    # lastData.dateutc is epoch milliseconds; tolerate seconds as well
+    dateutc = float(dateutc)
+    return dateutc / 1000.0 if dateutc > 1e11 else dateutc
+
+
+class PollScheduler(object):
+    # Tracks each station's last lastData.dateutc and learns its upload
+    # cadence so a poll can skip stations with nothing new and the next fetch
+    # can be timed for just after the next expected upload.
+    def __init__(self, cadences=UPLOAD_CADENCES, margin=POLL_MARGIN):
+        self.cadences = cadences
+        self.margin = margin
+        self.last = {}
+        self.cadence = {}
+        self.skipped = 0
+
+    def fresh(self, mac, dateutc):
+        # True (and recorded) if dateutc is newer than the last one seen
+        if dateutc is None:
+            return True
+        seen = epoch_seconds(dateutc)
+        last = self.last.get(mac)
+        if last is not None and seen <= last:
+            self.skipped += 1
+            return False
+        if last is not None:
+            self.learn(mac, seen - last)
+        self.last[mac] = seen
+        return True
+
+    def learn(self, mac, delta):
+        # Snap the observed interval to the nearest known cadence, ignoring
+        # gaps long enough to be missed uploads or outages.
+        if delta > self.cadences[-1] * 1.5:
+            return
+        self.cadence[mac] = min(self.cadences, key=lambda c: abs(c - delta))
+
+    def next_due(self):
+        # Epoch seconds of the earliest expected upload plus margin, 0 if unknown
+        if not self.last:
+            return 0
+        return min(last + self.cadence.get(mac, self.cadences[0]) + self.margin
+                   for mac, last in self.last.items())
+
+
+# Transports a reading can come from, in the order of the PwsNode GV0 index
+SOURCES = ('cache', 'poll', 'realtime', 'lan')
+
+
+class SourceArbiter(object):
+    # Decides, per station, which readings from the REST poll, the realtime
+    # socket and LAN uploads are published.  Readings are ordered by their
+    # dateutc: one no newer than the last accepted is a duplicate (same
+    # time) or out of order (older) and is dropped, so a slow transport can
+    # never overwrite a fresher one or resend a sample.  Accepted readings
+    # also go to the PollScheduler, which learns the upload cadence.
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.freshest = {}
+        self.pushed = {}
+        self.counts = collections.Counter()
+
+    def accept(self, mac, source, dateutc):
+        # Returns (accepted, epoch seconds of the previous accepted reading)
+        with self.lock:
+            last = self.scheduler.last.get(mac)
+            if dateutc is not None and last is not None:
+                seen = epoch_seconds(dateutc)
+                if seen <= last:
+                    self.counts[source, 'duplicate' if seen == last else 'stale'] += 1
+                    self.scheduler.skipped += 1
+                    return False, last
+            self.scheduler.fresh(mac, dateutc)
+            self.freshest[mac] = source
+            if source in ('realtime', 'lan'):
+                self.pushed[mac] = time.time()
+            self.counts[source, 'accepted'] += 1
+            return True, last
+
+    def pushing(self, now=None):
+        # True while every station has had a pushed reading within about two
+        # upload intervals, i.e. polling would only fetch duplicates.
+        now = now or time.time()
+        if not self.scheduler.last:
+            return False
+        return all(self.station_pushing(mac, now) for mac in list(self.scheduler.last))
+
+    def station_pushing(self, mac, now=None):
+        now = now or time.time()
+        scheduler = self.scheduler
+        pushed = self.pushed.get(mac)
+        cadence = scheduler.cadence.get(mac, scheduler.cadences[0])
+        return pushed is not None and now - pushed <= 2 * cadence + scheduler.margin
+
+    def stats(self):
+        stats = {}
+        for (source, outcome), count in self.counts.items():
+            stats.setdefault(source, {})[outcome] = count
+        return stats
+
+
+# Unacknowledged addNode requests allowed in flight, and how long to wait
+# for Polyglot to acknowledge one before moving on anyway.
+NODE_ADD_IN_FLIGHT = 4
+NODE_ADD_TIMEOUT = 10
+
+
+# Missed uploads before a gap in a station's readings is backfilled, the
+# records asked for per page (the API maximum) and the longest gap, in
+# seconds, worth backfilling; the history holds a day of samples.
+BACKFILL_MISSED = 3
+BACKFILL_LIMIT = 288
+BACKFILL_MAX = 24 * 3600
+
+
+class Backfill(object):
+    # Fills gaps in station history from the per-device endpoint
+    # (/v1/devices/<mac>?endDate=&limit=) on a background thread, so live
+    # updates carry on while it pages.  Pages arrive newest first and each
+    # is handed to Controller.backfill_records(); requests go through the
+    # same rate limiter and circuit breaker as polling.
+    def __init__(self, controller, limit=BACKFILL_LIMIT, span=BACKFILL_MAX):
+        self.controller = controller
+        self.limit = limit
+        self.span = span
+        self.gaps = collections.OrderedDict()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.records = 0
+        self.failed = 0
+
+    def request(self, mac, start, end):
+        # Backfill readings strictly between start and end (epoch seconds);
+        # a second gap for a station still waiting widens the first.
+        start = max(start, end - self.span)
+        with self.cond:
+            gap = self.gaps.get(mac)
+            if gap is not None:
+                start, end = min(start, gap[0]), max(end, gap[1])
+            self.gaps[mac] = (start, end)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='AmbientBackfill')
+                self.thread.daemon = True
+                self.thread.start()
+        LOGGER.info('Backfilling %s: %d seconds missed', mac, end - start)
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.gaps:
+                    self.thread = None
+                    return
+                mac, (start, end) = self.gaps.popitem(last=False)
+            try:
+                self.fill(mac, start, end)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.failed += 1
+                LOGGER.warning('Backfill of %s failed: %s', mac, e)
+
+    def fill(self, mac, start, end):
+        end_date = int(end * 1000)
+        while True:
+            page = self.controller.fetch_history(mac, end_date, self.limit)
+            records = [r for r in page if 'dateutc' in r and start < epoch_seconds(r['dateutc']) < end]
+            if records:
+                self.controller.backfill_records(mac, records)
+                self.records += len(records)
+            if len(page) < self.limit or not records:
+                return
+            oldest = int(min(epoch_seconds(r['dateutc']) for r in records) * 1000)
+            if oldest <= start * 1000 or oldest >= end_date:
+                return
+            end_date = oldest
+
+    def stats(self):
+        return {'records': self.records, 'failed': self.failed, 'waiting': len(self.gaps)}
+
+
+# Port for console and gateway uploads on the LAN; set with the 'lan_port'
+# custom parameter, 0 leaves the listener off.
+LAN_PORT = 0
+# Address the listener binds, set with 'lan_host'; '' is every interface
+LAN_HOST = ''
+# Stations not yet discovered through the API that LAN uploads may create
+# nodes for when the 'lan_new_stations' custom parameter is enabled
+LAN_NEW_MAX = 4
+# Upload parameters that are not readings
+LAN_IGNORED = frozenset(('PASSKEY', 'MAC', 'ID', 'PASSWORD', 'stationtype', 'model', 'freq', 'runtime', 'action',
+                         'realtime', 'rtfreq', 'dateutc'))
+# Ecowitt upload fields named differently from the Ambient API, with a
+# converter where the meaning differs too (Ecowitt batteries are 1 = low).
+LAN_FIELDS = {
+    'wh65batt': ('battout', lambda v: 1 - v),
+    'wh25batt': ('battin', lambda v: 1 - v),
+}
+for _n in range(1, 9):
+    LAN_FIELDS['soilmoisture{}'.format(_n)] = ('soilhum{}'.format(_n), None)
+# Fields Ecowitt gateways (POST) send under the Ambient name but with the
+# Ecowitt meaning: WH31 channel batteries are 0 = OK.  Ambient consoles
+# (GET) send batt1..batt8 as 1 = OK and use LAN_FIELDS alone.
+ECOWITT_FIELDS = dict(LAN_FIELDS)
+for _n in range(1, 9):
+    ECOWITT_FIELDS['batt{}'.format(_n)] = ('batt{}'.format(_n), lambda v: 1 - v)
+del _n
+MAC_PATTERN = re.compile(r'^[0-9A-Fa-f]{2}([:-]?[0-9A-Fa-f]{2}){5}$')
+
+
+class LocalHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class LanReceiver(object):
+    # Accepts the uploads Ambient consoles (GET query string) and Ecowitt
+    # gateways (POST form) send to a "custom server", and feeds them into
+    # Controller.ingest() like a reading from the cloud.  Stations are
+    # matched by the PASSKEY/MAC parameter: the station MAC itself, or the
+    # MD5 of it that Ecowitt gateways send.  Uploads carry no credentials,
+    # so only stations already known from the API are accepted unless
+    # new_stations is set, and then at most LAN_NEW_MAX of them.
+    def __init__(self, controller, port, host=LAN_HOST, new_stations=False):
+        self.controller = controller
+        self.port = port
+        self.host = host
+        self.new_stations = new_stations
+        self.server = None
+        self.keys = {}
+        self.created = 0
+        self.received = 0
+        self.unknown = 0
+
+    def start(self):
+        self.server = LocalHTTPServer((self.host, self.port), self.handler())
+        thread = threading.Thread(target=self.server.serve_forever, name='AmbientLan')
+        thread.daemon = True
+        thread.start()
+        LOGGER.info('Listening for LAN uploads on %s:%d', self.host or '*', self.port)
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                self.reply(receiver.upload(parse_qs(urlparse(self.path).query)))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8', 'replace')
+                self.reply(receiver.upload(parse_qs(body), ECOWITT_FIELDS))
+
+            def reply(self, ok):
+                # Consoles only look at the status; always answer quickly
+                body = b'success' if ok else b'unknown station'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def station(self, key):
+        # Known station MAC for a PASSKEY/MAC value; with new_stations,
+        # MAC-shaped keys of stations not seen yet are taken as they are.
+        controller = self.controller
+        if len(self.keys) < 3 * len(controller.station_names):
+            for mac in list(controller.station_names):
+                self.keys[mac.upper()] = mac
+                self.keys[mac.replace(':', '').upper()] = mac
+                self.keys[hashlib.md5(mac.upper().encode('utf-8')).hexdigest().upper()] = mac
+        mac = self.keys.get(key.upper())
+        if mac is None and self.new_stations and self.created < LAN_NEW_MAX and MAC_PATTERN.match(key):
+            digits = re.sub('[:-]', '', key).upper()
+            mac = ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+        return mac
+
+    @staticmethod
+    def reading(params, fields=LAN_FIELDS):
+        # Upload parameters as an Ambient API lastData dict
+        last_data = {}
+        for field, values in params.items():
+            if field in LAN_IGNORED:
+                continue
+            value = values[-1]
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+            if value.is_integer():
+                value = int(value)
+            field, convert = fields.get(field, (field, None))
+            last_data[field] = value if convert is None else convert(value)
+        dateutc = params.get('dateutc', ['now'])[-1]
+        try:
+            stamp = calendar.timegm(time.strptime(dateutc, '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            stamp = time.time()
+        last_data['dateutc'] = int(stamp * 1000)
+        return last_data
+
+    def upload(self, params, fields=LAN_FIELDS):
+        key = (params.get('PASSKEY') or params.get('MAC') or [''])[-1]
+        mac = self.station(key)
+        controller = self.controller
+        if mac is None:
+            self.unknown += 1
+            controller.log.log('lan_unknown', logging.WARNING,
+                               'LAN upload from unknown station %s; run discovery while it is online', key)
+            return False
+        self.received += 1
+        reading = Reading.from_dict(self.reading(params, fields))
+        controller.trace('LAN upload from %s', mac)
+        if mac not in controller.station_names:
+            LOGGER.warning('Creating nodes for station %s from its LAN uploads', mac)
+            self.created += 1
+            controller.station_names[mac] = str(params.get('stationtype', [mac])[-1])
+            controller.queue_station_nodes(mac, reading)
+        if controller.ingest(mac, reading, 'lan'):
+            with controller.dispatch_lock:
+                controller.publisher.flush()
+        return True
+
+    def stats(self):
+        return {'received': self.received, 'unknown': self.unknown, 'created': self.created}
+
+
+# Local snapshot API for other programs on the Polisy, enabled with the
+# 'snapshot_port' and/or 'snapshot_socket' custom parameters.  The port only
+# listens on the loopback interface.
+SNAPSHOT_HOST = '127.0.0.1'
+# Seconds between keep-alive comments on an idle event stream
+SNAPSHOT_KEEPALIVE = 30
+
+
+class Snapshot(object):
+    # Serves the latest reading of every station to local consumers in the
+    # Ambient /v1/devices format, so a dashboard or another node server can
+    # point its API URL here instead of spending the cloud rate limit.  The
+    # body is serialised once per change and tagged with an ETag, so
+    # conditional requests (If-None-Match) are answered with a bare 304;
+    # /v1/events pushes each new reading as a server-sent event.
+    def __init__(self, controller):
+        self.controller = controller
+        self.cond = threading.Condition()
+        self.epoch = '{:x}'.format(int(time.time()))
+        self.version = 0
+        self.changed = {}
+        self.body = None
+        self.etag = None
+        self.servers = []
+        self.socket_path = None
+        self.stopped = False
+        self.requests = collections.Counter()
+
+    def start(self, port=None, socket_path=None):
+        if port:
+            self.serve(LocalHTTPServer((SNAPSHOT_HOST, port), self.handler()))
+            LOGGER.info('Serving station snapshots on http://%s:%d/v1/devices', SNAPSHOT_HOST, port)
+        if socket_path:
+            # Only a socket left behind by an earlier run is replaced; a
+            # mistyped path must never delete someone's file
+            try:
+                mode = os.lstat(socket_path).st_mode
+            except OSError:
+                mode = None
+            if mode is not None and not stat.S_ISSOCK(mode):
+                LOGGER.error('snapshot_socket %s exists and is not a socket; not serving snapshots there', socket_path)
+                return self
+            if mode is not None:
+                os.remove(socket_path)
+            self.serve(LocalUnixHTTPServer(socket_path, self.handler()))
+            self.socket_path = socket_path
+            LOGGER.info('Serving station snapshots on %s', socket_path)
+        return self
+
+    def serve(self, server):
+        thread = threading.Thread(target=server.serve_forever, name='AmbientSnapshot')
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def update(self, mac):
+        with self.cond:
+            self.version += 1
+            self.changed[mac] = self.version
+            self.body = None
+            self.cond.notify_all()
+
+    def last_data(self, mac):
+        reading = self.controller.last_data.get(mac)
+        return {} if reading is None else reading.as_dict()
+
+    def device(self, mac):
+        return {'macAddress': mac, 'info': {'name': self.controller.station_names.get(mac, mac)},
+                'lastData': self.last_data(mac)}
+
+    def current(self):
+        # (ETag, body) of the whole snapshot, serialised at most once per change
+        with self.cond:
+            if self.body is None:
+                devices = [self.device(mac) for mac in sorted(list(self.controller.last_data))]
+                self.body = json.dumps(devices, separators=(',', ':')).encode('utf-8')
+                self.etag = '"{}-{}"'.format(self.epoch, self.version)
+            return self.etag, self.body
+
+    def wait(self, seen, timeout):
+        # Stations updated after version seen, waiting up to timeout for one
+        with self.cond:
+            if self.version == seen and not self.stopped:
+                self.cond.wait(timeout)
+            return self.version, sorted((version, mac) for mac, version in self.changed.items() if version > seen)
+
+    def handler(self):
+        snapshot = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip('/')
+                if path in ('', '/v1/devices'):
+                    self.devices()
+                elif path == '/v1/events':
+                    self.events()
+                else:
+                    self.send_error(404)
+
+            def devices(self):
+                etag, body = snapshot.current()
+                if etag in (self.headers.get('If-None-Match') or ''):
+                    snapshot.requests['not_modified'] += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                snapshot.requests['full'] += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def events(self):
+                snapshot.requests['events'] += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                seen = snapshot.version
+                try:
+                    while not snapshot.stopped:
+                        latest, updates = snapshot.wait(seen, SNAPSHOT_KEEPALIVE)
+                        if latest == seen:
+                            self.wfile.write(b': keepalive\n\n')
+                        for version, mac in updates:
+                            data = dict(snapshot.last_data(mac), macAddress=mac)
+                            self.wfile.write('id: {}\nevent: data\ndata: {}\n\n'.format(
+                                version, json.dumps(data, separators=(',', ':'))).encode('utf-8'))
+                        self.wfile.flush()
+                        seen = latest
+                except OSError:
+                    pass
+
+        return Handler
+
+    def stats(self):
+        return dict(self.requests, version=self.version)
+
+
+class NodeQueue(object):
+    # Adds nodes from a background thread, paced on Polyglot's addnode
+    # acknowledgements instead of fixed sleeps, so polling can update the
+    # nodes that already exist while the rest are still being created.
+    # Polyglot starts a node when it acknowledges the add, and its start()
+    # reports back through acknowledged(), which wakes the queue; an add
+    # not acknowledged within the timeout stops counting as in flight.
+    # on_idle runs once per burst of adds: after the
+    # queue has drained, every add has been acknowledged and no batch() (a
+    # discovery still queueing) is open.
+    def __init__(self, controller, in_flight=NODE_ADD_IN_FLIGHT, timeout=NODE_ADD_TIMEOUT, on_idle=None):
+        self.controller = controller
+        self.in_flight = in_flight
+        self.timeout = timeout
+        self.on_idle = on_idle
+        self.queue = collections.deque()
+        self.queued = set()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.holds = 0
+        self.adding = {}
+        self.added = 0
+
+    @contextlib.contextmanager
+    def batch(self):
+        with self.cond:
+            self.holds += 1
+        try:
+            yield self
+        finally:
+            with self.cond:
+                self.holds -= 1
+                self.cond.notify()
+
+    def put(self, node):
+        with self.cond:
+            if node.address in self.queued or node.address in self.controller.nodes:
+                return False
+            self.queue.append(node)
+            self.queued.add(node.address)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='AmbientNodeQueue')
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+        return True
+
+    def busy(self):
+        return bool(self.queue)
+
+    def acknowledged(self, address):
+        with self.cond:
+            if self.adding.pop(address, None) is not None:
+                self.cond.notify_all()
+
+    def unacknowledged(self):
+        # Adds still waiting for their acknowledgement; call holding cond
+        now = time.monotonic()
+        for address, sent in list(self.adding.items()):
+            if now - sent > self.timeout:
+                del self.adding[address]
+        return len(self.adding)
+
+    def settle(self, in_flight):
+        # Wait, up to the timeout, for fewer than in_flight unacknowledged adds
+        deadline = time.monotonic() + self.timeout
+        with self.cond:
+            while self.unacknowledged() >= in_flight:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self.cond.wait(left)
+
+    def run(self):
+        added = 0
+        while True:
+            with self.cond:
+                while not self.queue and self.holds:
+                    self.cond.wait()
+                node = self.queue.popleft() if self.queue else None
+            if node is None:
+                self.settle(1)
+                with self.cond:
+                    if self.queue or self.holds:
+                        continue
+                    self.thread = None
+                    break
+            self.settle(self.in_flight)
+            with self.cond:
+                # Before addNode: the acknowledgement can beat its return
+                self.adding[node.address] = time.monotonic()
+            try:
+                self.controller.addNode(node)
+                self.added += 1
+                added += 1
+            except Exception as e:
+                LOGGER.error('Failed to add node %s: %s', node.address, e)
+                with self.cond:
+                    self.adding.pop(node.address, None)
+            with self.cond:
+                self.queued.discard(node.address)
+        if added and self.on_idle is not None:
+            self.on_idle()
+
+
+# Marks a field the station did not report in Reading.values and history
+MISSING = float('nan')
+# Keys Reading keeps elsewhere: dateutc in its own slot, and the macAddress
+# realtime events carry alongside the readings
+READING_KEYS = frozenset(('dateutc', 'macAddress'))
+
+
+class Reading(object):
+    # One station upload in a fixed layout: values[FIELD_INDEX[field]] for
+    # every field in the FIELDS enum, NaN where the station did not report
+    # it, and a bit per reported field in mask.  Everything else the API
+    # sent (date, tz, lastRain, sensors without nodes such as PM2.5 or
+    # lightning) is passed through untouched in extra, None when there is
+    # none.  ingest() converts each lastData dict once and keeps only this;
+    # get() and `in` read it like the dict, as_dict() rebuilds it for the
+    # cache and snapshot API.
+    __slots__ = ('dateutc', 'values', 'mask', 'extra')
+
+    def __init__(self, dateutc, values, mask, extra=None):
+        self.dateutc = dateutc
+        self.values = values
+        self.mask = mask
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, last_data):
+        values = array('d', EMPTY_VALUES)
+        mask = 0
+        extra = None
+        index = FIELD_INDEX
+        for field, value in last_data.items():
+            i = index.get(field)
+            if i is not None and not isinstance(value, bool):
+                try:
+                    values[i] = value
+                    mask |= 1 << i
+                    continue
+                except TypeError:
+                    try:
+                        values[i] = float(value)
+                        mask |= 1 << i
+                        continue
+                    except (TypeError, ValueError):
+                        pass
+            if field not in READING_KEYS:
+                if extra is None:
+                    extra = {}
+                extra[field] = value
+        return cls(last_data.get('dateutc'), values, mask, extra)
+
+    @staticmethod
+    def number(value):
+        # Whole numbers go out as ints, as they came from the API
+        return int(value) if value.is_integer() else value
+
+    def get(self, field, default=None):
+        if field == 'dateutc':
+            return self.dateutc
+        i = FIELD_INDEX.get(field)
+        if i is not None and self.mask >> i & 1:
+            return self.number(self.values[i])
+        if self.extra is not None:
+            return self.extra.get(field, default)
+        return default
+
+    def __contains__(self, field):
+        if field == 'dateutc':
+            return self.dateutc is not None
+        i = FIELD_INDEX.get(field)
+        if i is not None and self.mask >> i & 1:
+            return True
+        return self.extra is not None and field in self.extra
+
+    def merged(self, previous):
+        # This reading over the previous one, field by field, so a partial
+        # upload (a LAN upload has no feels like or dew point) keeps the
+        # fields it did not carry.  A reading with no dateutc keeps the
+        # previous one's.
+        if previous is None:
+            return self
+        values = array('d', previous.values)
+        mask = self.mask
+        for i in range(len(FIELDS)):
+            if mask >> i & 1:
+                values[i] = self.values[i]
+        extra = previous.extra
+        if self.extra is not None:
+            extra = dict(extra or {}, **self.extra)
+        dateutc = self.dateutc if self.dateutc is not None else previous.dateutc
+        return Reading(dateutc, values, previous.mask | mask, extra)
+
+    def missing_from(self, other):
+        # The fields and extras of this reading that other lacks, with no
+        # dateutc, or None when other has them all
+        mask = self.mask & ~other.mask
+        extra = None
+        if self.extra is not None:
+            extra = dict((field, value) for field, value in self.extra.items()
+                         if other.extra is None or field not in other.extra) or None
+        if not mask and extra is None:
+            return None
+        values = array('d', EMPTY_VALUES)
+        for i in range(len(FIELDS)):
+            if mask >> i & 1:
+                values[i] = self.values[i]
+        return Reading(None, values, mask, extra)
+
+    def as_dict(self):
+        last_data = dict((field, self.number(self.values[i]))
+                         for i, field in enumerate(FIELDS) if self.mask >> i & 1)
+        if self.extra is not None:
+            last_data.update(self.extra)
+        if self.dateutc is not None:
+            last_data['dateutc'] = self.dateutc
+        return last_data
+
+
+# Samples kept per station: 24 hours of 1 minute uploads
+HISTORY_SIZE = 1440
+
+
+class StationHistory(object):
+    # Fixed-size ring of one station's readings: a shared array of epoch
+    # seconds and one float32 column per reported field, NaN where a
+    # reading lacked the field.  Appends are O(fields); samples stay in
+    # time order so range queries bisect.
+    __slots__ = ('size', 'times', 'columns', 'mask', 'start', 'count')
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array('d', bytes(8 * size))
+        self.columns = {}
+        self.mask = 0
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def column(self, i):
+        column = self.columns[i] = array('f', [MISSING]) * self.size
+        self.mask |= 1 << i
+        return column
+
+    def append(self, t, reading):
+        if self.count and t <= self.times[(self.start + self.count - 1) % self.size]:
+            return False
+        if self.count < self.size:
+            slot = (self.start + self.count) % self.size
+            self.count += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.size
+        self.times[slot] = t
+        values = reading.values
+        for i, column in self.columns.items():
+            column[slot] = values[i]
+        new = reading.mask & ~self.mask
+        while new:
+            i = (new & -new).bit_length() - 1
+            self.column(i)[slot] = values[i]
+            new &= new - 1
+        return True
+
+    def merge(self, rows):
+        # Merges older (backfilled) (t, Reading) rows in, keeping the newest
+        # size samples in time order; samples already held win on equal times.
+        merged = {}
+        mask = self.mask
+        for t, reading in rows:
+            merged[t] = reading.values
+            mask |= reading.mask
+        for n in range(self.count):
+            slot = (self.start + n) % self.size
+            values = array('d', EMPTY_VALUES)
+            for i, column in self.columns.items():
+                values[i] = column[slot]
+            merged[self.times[slot]] = values
+        ordered = sorted(merged.items())[-self.size:]
+        added = len(ordered) - self.count
+        columns = [(i, self.columns.get(i) or self.column(i)) for i in range(len(FIELDS)) if mask >> i & 1]
+        self.start = 0
+        self.count = len(ordered)
+        for slot, (t, values) in enumerate(ordered):
+            self.times[slot] = t
+            for i, column in columns:
+                column[slot] = values[i]
+        return added
+
+    def _bisect(self, t):
+        # Logical index of the first sample at or after t
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[(self.start + mid) % self.size] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @staticmethod
+    def value(v):
+        # float32 keeps about 7 significant digits; give back the decimal
+        # the station reported rather than its float32 neighbour
+        return float('{:.7g}'.format(v))
+
+    def range(self, i, start, end=None):
+        # (t, value) samples of field i with start <= t <= end, oldest first
+        column = self.columns.get(i)
+        if column is None:
+            return []
+        first = self._bisect(start)
+        last = self.count if end is None else self._bisect(end + 1e-6)
+        samples = []
+        for n in range(first, last):
+            slot = (self.start + n) % self.size
+            v = column[slot]
+            if v == v:
+                samples.append((self.times[slot], self.value(v)))
+        return samples
+
+    def latest(self, i):
+        column = self.columns.get(i)
+        if column is None:
+            return None
+        for n in range(self.count - 1, -1, -1):
+            slot = (self.start + n) % self.size
+            if column[slot] == column[slot]:
+                return self.times[slot], self.value(column[slot])
+        return None
+
+
+class HistoryStore(object):
+    # Bounded in-memory history of every field the node server publishes,
+    # one StationHistory per station.  Memory is fixed by HISTORY_SIZE and
+    # the fields each station reports, regardless of uptime.
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.stations = {}
+
+    def station(self, mac):
+        history = self.stations.get(mac)
+        if history is None:
+            history = self.stations[mac] = StationHistory(self.size)
+        return history
+
+    def record(self, mac, reading):
+        if reading.dateutc is None:
+            return False
+        return self.station(mac).append(epoch_seconds(reading.dateutc), reading)
+
+    def merge(self, mac, readings):
+        # Backfilled readings, in any order, merged into the station's history
+        rows = [(epoch_seconds(r.dateutc), r) for r in readings if r.dateutc is not None]
+        return self.station(mac).merge(rows) if rows else 0
+
+    def range(self, mac, field, start, end=None):
+        history = self.stations.get(mac)
+        return [] if history is None else history.range(FIELD_INDEX[field], start, end)
+
+    def latest(self, mac, field):
+        history = self.stations.get(mac)
+        return None if history is None else history.latest(FIELD_INDEX[field])
+
+
+class RollingWindow(object):
+    # Samples from a trailing time span with O(1) amortised updates: a
+    # running sum for the mean, the oldest/newest samples for deltas and a
+    # monotonic deque for the maximum.
+    __slots__ = ('span', 'samples', 'peaks', 'total')
+
+    def __init__(self, span):
+        self.span = span
+        self.samples = collections.deque()
+        self.peaks = collections.deque()
+        self.total = 0.0
+
+    def add(self, t, value):
+        self.samples.append((t, value))
+        self.total += value
+        while self.peaks and self.peaks[-1][1] <= value:
+            self.peaks.pop()
+        self.peaks.append((t, value))
+        cutoff = t - self.span
+        while self.samples[0][0] < cutoff:
+            old_t, old_value = self.samples.popleft()
+            self.total -= old_value
+            if self.peaks[0][0] <= old_t:
+                self.peaks.popleft()
+
+    def clear(self):
+        self.samples.clear()
+        self.peaks.clear()
+        self.total = 0.0
+
+    def newest(self):
+        return self.samples[-1][1] if self.samples else None
+
+    def delta(self):
+        return self.samples[-1][1] - self.samples[0][1]
+
+    def rate(self, per=3600):
+        elapsed = self.samples[-1][0] - self.samples[0][0]
+        return self.delta() * per / elapsed if elapsed > 0 else 0.0
+
+    def max(self):
+        return self.peaks[0][1]
+
+    def mean(self):
+        return self.total / len(self.samples)
+
+
+def pressure_trend(window, t, value):
+    window.add(t, value)
+    return round(window.delta(), 3)
+
+
+def rain_rate(window, t, value):
+    # dailyrainin is cumulative; a drop means the daily counter was reset
+    if window.newest() is not None and value < window.newest():
+        window.clear()
+    window.add(t, value)
+    return round(window.rate(), 2)
+
+
+def peak(window, t, value):
+    window.add(t, value)
+    return window.max()
+
+
+# Values derived from rolling windows over incoming readings.
+#   (source field, window seconds, function, node suffix, driver)
+DERIVED_METRICS = [
+    ('baromrelin', 3 * 3600, pressure_trend, 'hg', 'GV0'),
+    ('dailyrainin', 10 * 60, rain_rate, 'rh', 'GV0'),
+    ('windgustmph', 10 * 60, peak, 'wnd', 'GV3'),
+]
+
+
+class DerivedMetrics(object):
+    # Feeds each reading into per-station rolling windows and returns the
+    # (node suffix, driver, value) updates to publish.
+    def __init__(self, metrics=DERIVED_METRICS):
+        self.metrics = metrics
+        self.windows = {}
+
+    def update(self, mac, last_data):
+        dateutc = last_data.get('dateutc')
+        if dateutc is None:
+            return []
+        t = epoch_seconds(dateutc)
+        updates = []
+        for field, span, compute, suffix, driver in self.metrics:
+            value = last_data.get(field)
+            if value is None:
+                continue
+            window = self.windows.get((mac, field, span))
+            if window is None:
+                window = self.windows[(mac, field, span)] = RollingWindow(span)
+            elif window.samples and t <= window.samples[-1][0]:
+                continue
+            updates.append((suffix, driver, compute(window, t, float(value))))
+        return updates
+
+    def rebuild(self, mac, history):
+        # Replays the station's windows from its history, e.g. once backfill
+        # has filled a gap, and returns the recomputed updates.
+        updates = []
+        for field, span, compute, suffix, driver in self.metrics:
+            latest = history.latest(mac, field)
+            if latest is None:
+                continue
+            window = self.windows[(mac, field, span)] = RollingWindow(span)
+            for t, value in history.range(mac, field, latest[0] - span):
+                result = compute(window, t, value)
+            updates.append((suffix, driver, result))
+        return updates
+
+
+# Durations kept per timed phase, and the histogram bucket bounds in ms
+TIMING_SAMPLES = 500
+TIMING_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PhaseTimers(object):
+    # Rolling samples of how long each phase of the poll path takes
+    # (fetch, decode, dispatch, publish, poll, discover), in milliseconds.
+    def __init__(self, size=TIMING_SAMPLES):
+        self.size = size
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def time(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, (time.perf_counter() - start) * 1000)
+
+    def record(self, phase, ms):
+        with self.lock:
+            samples = self.samples.get(phase)
+            if samples is None:
+                samples = self.samples[phase] = collections.deque(maxlen=self.size)
+            samples.append(ms)
+
+    def last(self, phase):
+        samples = self.samples.get(phase)
+        return samples[-1] if samples else 0
+
+    def summary(self):
+        summary = {}
+        with self.lock:
+            phases = [(phase, sorted(samples)) for phase, samples in self.samples.items()]
+        for phase, ordered in phases:
+            if not ordered:
+                continue
+            pick = lambda pct: ordered[int(pct / 100.0 * (len(ordered) - 1))]
+            buckets = [0] * (len(TIMING_BUCKETS) + 1)
+            for ms in ordered:
+                buckets[next((i for i, b in enumerate(TIMING_BUCKETS) if ms <= b), len(TIMING_BUCKETS))] += 1
+            summary[phase] = {'n': len(ordered), 'p50': pick(50), 'p90': pick(90), 'p99': pick(99),
+                              'max': ordered[-1], 'buckets': buckets}
+        return summary
+
+    def dump(self):
+        labels = ['<={}'.format(b) for b in TIMING_BUCKETS] + ['>{}'.format(TIMING_BUCKETS[-1])]
+        lines = []
+        for phase, s in sorted(self.summary().items()):
+            lines.append('{:<9} n={:<4} p50={:.1f} p90={:.1f} p99={:.1f} max={:.1f} ms  {}'.format(
+                phase, s['n'], s['p50'], s['p90'], s['p99'], s['max'],
+                ' '.join('{}:{}'.format(l, c) for l, c in zip(labels, s['buckets']) if c)))
+        return lines
+
+
+class StationRegistry(object):
+    # Maps each station MAC to its node address once, and keeps a per-station
+    # table of (field -> node, driver, converter) references so dispatch does
+    # no string building or node lookups.
+    #
+    # The address is the historical MAC-without-colons-and-zeros form so
+    # existing ISY nodes keep working.  Dropping zeros can make two MACs
+    # collide; the later one then gets 'x' + a hash of its MAC, which never
+    # clashes with the hex-only legacy form.  Assignments are saved in the
+    # warm start cache so they survive restarts whatever the discovery order.
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.lock = threading.Lock()
+        self.addresses = {}
+        self.owners = {}
+        self.tables = {}
+
+    @staticmethod
+    def legacy_address(mac):
+        return mac.replace(':', '').replace('0', '').lower()
+
+    @staticmethod
+    def hashed_address(mac):
+        return 'x' + hashlib.sha1(mac.lower().encode('utf-8')).hexdigest()[:10]
+
+    def load(self, addresses):
+        with self.lock:
+            for mac, address in addresses.items():
+                if address not in self.owners:
+                    self.addresses[mac] = address
+                    self.owners[address] = mac
+
+    def address(self, mac):
+        address = self.addresses.get(mac)
+        if address is not None:
+            return address
+        # Assigned under the lock: discovery, the node queue, the websocket
+        # and LAN threads can all meet a new station at the same time.
+        with self.lock:
+            address = self.addresses.get(mac)
+            if address is None:
+                address = self.legacy_address(mac)
+                if address in self.owners:
+                    LOGGER.warning('Station %s collides with %s at address %s', mac, self.owners[address], address)
+                    address = self.hashed_address(mac)
+                self.addresses[mac] = address
+                self.owners[address] = mac
+        return address
+
+    def node(self, mac, suffix):
+        return self.nodes.get(self.address(mac) + suffix)
+
+    def table(self, mac):
+        # (field index, routes) for the fields that have a node, in FIELDS
+        # order; rebuilt only when nodes have been added since it was built
+        entry = self.tables.get(mac)
+        if entry is not None and entry[0] == len(self.nodes):
+            return entry[1]
+        address = self.address(mac)
+        nodes = self.nodes
+        table = []
+        for i, field in enumerate(FIELDS):
+            resolved = []
+            for suffixes, driver, convert in FIELD_ROUTES[field]:
+                node = next((nodes[address + s] for s in suffixes if address + s in nodes), None)
+                if node is not None:
+                    resolved.append((node, driver, convert))
+            if resolved:
+                table.append((i, tuple(resolved)))
+        self.tables[mac] = (len(self.nodes), table)
+        return table
+
+
+# Last device list and readings, used to populate nodes before the API answers
+CACHE_FILE = 'ambient_cache.json'
+# Minimum seconds between cache writes
+CACHE_INTERVAL = 60
+
 
 class Controller(polyinterface.Controller):
     def __init__(self, polyglot):
@@ -28,34 +1563,125 @@ class Controller(polyinterface.Controller):
         self.name = 'Ambient Weather'
         self.app_key = ''
         self.api_key = ''
+        self.accounts = []
+        self.executor = None
         self.disco = 0
+        self.api_url = API_BASE + '/v1/devices'
+        self.realtime_url = None
+        self.lan_port = LAN_PORT
+        self.lan_host = LAN_HOST
+        self.lan_new_stations = False
+        self.lan = None
+        self.snapshot_port = None
+        self.snapshot_socket = None
+        self.snapshot = None
+        self.session = self.http_session()
+        self.trace = DebugTrace()
+        self.log = LogLimiter()
+        self.limiter = RateLimiter()
+        self.app_limiter = RateLimiter(APP_RATE, APP_BURST)
+        self.worker = ApiWorker(log=self.log)
+        self.breaker = CircuitBreaker(on_change=self.set_stale)
+        self.publisher = DriverPublisher(DEADBANDS, trace=self.trace)
+        self.dispatch_lock = threading.Lock()
+        self.ws_thread = None
+        self.ws_loop = None
+        self.ws_stop = None
+        self.ws_accounts = set()
+        self.scheduler = PollScheduler()
+        self.arbiter = SourceArbiter(self.scheduler)
+        self.poll_timer = None
+        self.last_data = {}
+        # Last accepted reading per station as it arrived, before merging,
+        # and the dateutc (epoch seconds) of the newest sample that filled
+        # fields it lacked
+        self.latest = {}
+        self.filled = {}
+        self.next_fill = 0
+        self.stale = set()
+        self.station_names = {}
+        self.station_accounts = {}
+        self.fingerprints = {}
+        self.cache_saved = 0
+        self.cache_lock = threading.Lock()
+        self.history = HistoryStore()
+        self.metrics = DerivedMetrics()
+        self.timers = PhaseTimers()
+        self.registry = StationRegistry(self.nodes)
+        self.node_queue = NodeQueue(self, on_idle=self.nodes_added)
+        self.backfill = Backfill(self)
 
     def start(self):
         LOGGER.info('Started AmbientWeather')
         self.removeNoticesAll()
         if self.check_params():
             self.removeNoticesAll()
-            self.discover()
-            # if self.disco == 1:
-            #     if WEBSOCKET:
-            #         time.sleep(5)
-            #         _loop = asyncio.new_event_loop()
-            #         _loop.create_task(self.AmbientWeather(self.app_key, self.api_key))
-            #         _loop.run_forever()
-            #     else:
-            #         LOGGER.info("Websocket Disabled")
-            # else:
-            #     LOGGER.info("Discovery not complete")
+            if self.lan_port:
+                self.start_lan()
+            if self.snapshot_port or self.snapshot_socket:
+                self.start_snapshot()
+            # Nodes and last readings come from the cache when there is
+            # one; either way discovery runs on the API worker, bounded by
+            # the cycle deadline, without holding up Polyglot's thread.
+            self.load_cache()
+            self.worker.submit('discover', self.discover_cycle, POLL_DEADLINE)
+            if WEBSOCKET:
+                self.start_websocket()
+            else:
+                LOGGER.info("Websocket Disabled")
         else:
             LOGGER.info('APP / API Key is not set')
 
+    def start_lan(self):
+        try:
+            self.lan = LanReceiver(self, self.lan_port, self.lan_host, self.lan_new_stations).start()
+        except (OSError, ValueError) as e:
+            LOGGER.error('Could not listen for LAN uploads on port %s: %s', self.lan_port, e)
+
+    def start_snapshot(self):
+        try:
+            self.snapshot = Snapshot(self).start(self.snapshot_port, self.snapshot_socket)
+        except (OSError, ValueError) as e:
+            LOGGER.error('Could not serve station snapshots: %s', e)
+
     def shortPoll(self):
-        if self.disco == 1:
-            LOGGER.info("Short Poll:  Ambient Weather Updating")
-            self.ambient_weather_update()
+        # Polling is the fallback while the realtime websocket is down.
+        # While stations push over the LAN it only fills in, every
+        # POLL_FILL_INTERVAL, fields their uploads do not carry.
+        if self.disco == 1 and not self.ws_connected():
+            if self.arbiter.pushing():
+                if not self.push_gaps() or time.time() < self.next_fill:
+                    LOGGER.debug("Short Poll:  Stations are pushing readings")
+                    return
+                self.next_fill = time.time() + POLL_FILL_INTERVAL
+            elif time.time() < self.scheduler.next_due():
+                LOGGER.debug("Short Poll:  No upload expected yet")
+                return
+            self.log.log('short_poll', logging.INFO, 'Short Poll:  Ambient Weather Updating')
+            self.worker.submit('poll', self.poll_cycle, POLL_DEADLINE)
+
+    def poll_cycle(self, deadline=None):
+        try:
+            self.ambient_weather_update(deadline)
+        finally:
+            self.arm_poll_timer()
+
+    def arm_poll_timer(self):
+        # Fetch right after the next expected upload when that comes before
+        # the next short poll; shortPoll() covers everything else.
+        if self.poll_timer is not None:
+            self.poll_timer.cancel()
+            self.poll_timer = None
+        delay = self.scheduler.next_due() - time.time()
+        if POLL_MIN_DELAY <= delay < int(self.polyConfig.get('shortPoll', 60)):
+            self.poll_timer = threading.Timer(delay, self.shortPoll)
+            self.poll_timer.daemon = True
+            self.poll_timer.start()
 
     def longPoll(self):
-        pass
+        LOGGER.debug('Ambient API requests: %s', self.limiter.stats())
+        if self.disco == 1:
+            self.rediscover()
 
     @staticmethod
     def lux_convert(wm2):
@@ -115,508 +1741,508 @@ class Controller(polyinterface.Controller):
     def percent_to_moisture_level(percent):
         pass
 
+    @staticmethod
+    def http_session():
+        # One keep-alive session shared by discovery and polling so each poll
+        # reuses the pooled TLS connection instead of handshaking again.  Once
+        # the status retries run out the last 5xx response is returned, so
+        # raise_for_status() reports it as an HTTPError.
+        retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=HTTP_RETRIES,
+                      backoff_factor=0.5, status_forcelist=(500, 502, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(HTTP_POOL_SIZE, ACCOUNT_WORKERS),
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Connection': 'keep-alive', 'Accept': 'application/json'})
+        return session
+
+    def api_get(self, url=None, account=None, deadline=None, **params):
+        # deadline (monotonic time) bounds the whole call: rate limiter waits,
+        # 429 backoffs and urllib3's own retries (see api_request)
+        url = url or self.api_url
+        app_key, api_key = account or (self.app_key, self.api_key)
+        params.update({'applicationKey': app_key, 'apiKey': api_key})
+        if not self.breaker.allow():
+            raise ApiUnavailable('Ambient API circuit breaker is open')
+        try:
+            data = self.api_request(url, api_key, params, deadline)
+        except RateLimitTimeout:
+            self.breaker.release()
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.RetryError, ValueError):
+            self.breaker.failure()
+            raise
+        except requests.exceptions.HTTPError as e:
+            # Server errors count against the breaker; a rejected key or a
+            # rate limit means the API itself is up.
+            if e.response is not None and e.response.status_code >= 500:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            raise
+        self.breaker.success()
+        return data
+
+    def api_request(self, url, api_key, params, deadline):
+        attempt = 0
+        while True:
+            self.limiter.acquire(api_key, deadline)
+            self.app_limiter.acquire(params['applicationKey'], deadline)
+            timeout = HTTP_TIMEOUT
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise requests.exceptions.Timeout('Ambient API cycle deadline passed')
+                # One session.get makes up to HTTP_RETRIES + 1 attempts, each
+                # with the full timeout, so each gets its share of the time
+                # left.  The read timeout applies per socket read and the
+                # urllib3 backoff adds about a second, so this is close to,
+                # not strictly within, the deadline.
+                share = left / (HTTP_RETRIES + 1)
+                timeout = (min(HTTP_TIMEOUT[0], share), min(HTTP_TIMEOUT[1], share))
+            with self.timers.time('fetch'):
+                r = self.session.get(url, params=params, timeout=timeout)
+            if r.status_code not in (429, 503) or attempt >= API_RETRIES:
+                break
+            if r.status_code == 429:
+                self.limiter.throttled += 1
+            self.limiter.retried += 1
+            delay = self.limiter.backoff(api_key, attempt, self.limiter.retry_after(r))
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            self.log.log('api_retry', logging.WARNING, 'Ambient API returned %d, retrying in %.1f seconds',
+                         r.status_code, delay)
+            attempt += 1
+        r.raise_for_status()
+        with self.timers.time('decode'):
+            return r.json()
+
+    def fetch_devices(self, deadline=None):
+        # Device lists of every configured account merged into one, fetched
+        # concurrently on a bounded pool; each key keeps its own rate limit.
+        if len(self.accounts) <= 1:
+            return self.api_get(deadline=deadline)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=min(ACCOUNT_WORKERS, len(self.accounts)))
+        futures = [self.executor.submit(self.api_get, account=account, deadline=deadline)
+                   for account in self.accounts]
+        devices = {}
+        error = None
+        for account, future in zip(self.accounts, futures):
+            try:
+                for pws in future.result():
+                    if pws['macAddress'] not in devices:
+                        devices[pws['macAddress']] = pws
+                        self.station_accounts[pws['macAddress']] = account
+            except (requests.exceptions.RequestException, ValueError) as e:
+                LOGGER.warning('Ambient account fetch failed: %s', e)
+                error = e
+        if error is not None and not devices:
+            raise error
+        return list(devices.values())
+
+    def fetch_history(self, mac, end_date, limit):
+        # Readings before end_date (epoch ms), newest first
+        return self.api_get('{}/{}'.format(self.api_url, mac), account=self.station_accounts.get(mac),
+                            endDate=end_date, limit=limit)
+
+    def station_address(self, mac):
+        return self.registry.address(mac)
+
+    def dispatch(self, mac, reading):
+        # One pass over the station's precomputed (field index -> node
+        # references) table, skipping fields the reading does not have.
+        values = reading.values
+        number = Reading.number
+        publish = self.publisher.publish
+        for i, routes in self.registry.table(mac):
+            value = values[i]
+            if value != value:
+                continue
+            value = number(value)
+            for node, driver, convert in routes:
+                publish(node, driver, value if convert is None else convert(value))
+
     def query(self):
         for node in self.nodes:
             self.nodes[node].reportDrivers()
 
     def discover(self, *args, **kwargs):
-        api_url = 'https://api.ambientweather.net/v1/devices?applicationKey=' + self.app_key + '&apiKey=' + self.api_key
+        self.discover_cycle()
+
+    def discover_cycle(self, deadline=None):
+        with self.timers.time('discover'):
+            self.discover_stations(deadline)
 
+    def discover_command(self, command=None):
+        self.worker.submit('discover', self.discover_cycle, POLL_DEADLINE)
+
+    def discover_stations(self, deadline=None):
         try:
-            r = requests.get(api_url)
-            data = r.json()
-
-            for pws in data:
-                LOGGER.info(pws['macAddress'])
-                LOGGER.info(pws['info']['name'])
-                pws_address = pws['macAddress'].replace(':', '').replace('0', '').lower()
-                pws_name = str(pws['info']['name'])
-
-                self.addNode(PwsNode(self, pws_address, pws_address, pws_name))
-
-                if 'battin' in pws['lastData']:
-                    self.addNode((BatteryInsideNode(self, pws_address, pws_address + "bi", "Battery - Inside")))
-                if 'battout' in pws['lastData']:
-                    self.addNode((BatteryOutsideNode(self, pws_address, pws_address + "bo", "Battery - Outside")))
-                if 'tempf' in pws['lastData']:
-                    self.addNode((TempOutsideNode(self, pws_address, pws_address + "to", "Temperature - Outside")))
-                if 'tempinf' in pws['lastData']:
-                    self.addNode((TempInsideNode(self, pws_address, pws_address + "ti", "Temperature - Inside")))
-                if 'feelsLike' in pws['lastData']:
-                    self.addNode((FeelsLikeOutsideNode(self, pws_address, pws_address + "fl", "Feels Like - Outside")))
-                if 'feelsLikein' in pws['lastData']:
-                    self.addNode((FeelsLikeInsideNode(self, pws_address, pws_address + "fli", "Feels Like - Inside")))
-                if 'dewPoint' in pws['lastData']:
-                    self.addNode((DewPointOutsideNode(self, pws_address, pws_address + "dp", "Dew Point - Outside")))
-                if 'dewPointin' in pws['lastData']:
-                    self.addNode((DewPointInsideNode(self, pws_address, pws_address + "dpi", "Dew Point - Inside")))
-                if 'humidity' in pws['lastData']:
-                    self.addNode((HumidityOutsideNode(self, pws_address, pws_address + "ho", "Humidity - Outside")))
-                if 'humidityin' in pws['lastData']:
-                    self.addNode((HumidityInsideNode(self, pws_address, pws_address + "hi", "Humidity - Inside")))
-                if 'baromabsin' in pws['lastData'] and 'baromrelin' in pws['lastData']:
-                    self.addNode((PressureNode(self, pws_address, pws_address + "hg", "Barometric Pressure")))
-                if 'dailyrainin' in pws['lastData']:
-                    self.addNode((RainDayNode(self, pws_address, pws_address + "rd", "Rain - Day")))
-                if 'monthlyrainin' in pws['lastData']:
-                    self.addNode((RainMonthNode(self, pws_address, pws_address + "rm", "Rain - Month")))
-                if 'weeklyrainin' in pws['lastData']:
-                    self.addNode((RainWeekNode(self, pws_address, pws_address + "rw", "Rain - Week")))
-                if 'totalrainin' in pws['lastData']:
-                    self.addNode((RainTotalNode(self, pws_address, pws_address + "rt", "Rain - Total")))
-                if 'yearlyrainin' in pws['lastData']:
-                    self.addNode((RainYearNode(self, pws_address, pws_address + "ry", "Rain - Year")))
-                if 'eventrainin' in pws['lastData']:
-                    self.addNode((RainEventNode(self, pws_address, pws_address + "re", "Rain - Event")))
-                if 'hourlyrainin' in pws['lastData']:
-                    self.addNode((RainHourNode(self, pws_address, pws_address + "rh", "Rain - Hour")))
-                if 'uv' in pws['lastData'] and 'solarradiation' in pws['lastData']:
-                    self.addNode((SolarNode(self, pws_address, pws_address + "sol", "Solar")))
-                if 'winddir' in pws['lastData']:
-                    self.addNode((WindNode(self, pws_address, pws_address + "wnd", "Wind")))
-                # Artificial pause to let ISY catch up
-                time.sleep(2)
-
-                if 'temp1f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as1", "Sensor 1")))
-                if 'temp2f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as2", "Sensor 2")))
-                if 'temp3f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as3", "Sensor 3")))
-                if 'temp4f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as4", "Sensor 4")))
-                if 'temp5f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as5", "Sensor 5")))
-                if 'temp6f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as6", "Sensor 6")))
-                if 'temp7f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as7", "Sensor 7")))
-                if 'temp8f' in pws['lastData']:
-                    self.addNode((WH31Node(self, pws_address, pws_address + "as8", "Sensor 8")))
-                # Artificial pause to let ISY catch up
-                time.sleep(2)
-
-                if 'soiltemp1' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm1", "Soil Moisture 1")))
-                if 'soiltemp2' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm2", "Soil Moisture 2")))
-                if 'soiltemp3' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm3", "Soil Moisture 3")))
-                if 'soiltemp4' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm4", "Soil Moisture 4")))
-                if 'soiltemp5' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm5", "Soil Moisture 5")))
-                if 'soiltemp6' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm6", "Soil Moisture 6")))
-                if 'soiltemp7' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "sm7", "Soil Moisture 7")))
-                if 'soiltemp8' in pws['lastData']:
-                    self.addNode((TX3102Node(self, pws_address, pws_address + "as8", "Soil Moisture 8")))
-                # Artificial pause to let ISY catch up
-                time.sleep(2)
-                if 'soilhum1' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm1", "Soil Moisture 1")))
-                if 'soilhum2' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm2", "Soil Moisture 2")))
-                if 'soilhum3' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm3", "Soil Moisture 3")))
-                if 'soilhum4' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm4", "Soil Moisture 4")))
-                if 'soilhum5' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm5", "Soil Moisture 5")))
-                if 'soilhum6' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm6", "Soil Moisture 6")))
-                if 'soilhum7' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "sm7", "Soil Moisture 7")))
-                if 'soilhum8' in pws['lastData']:
-                    self.addNode((WH31SMNode(self, pws_address, pws_address + "as8", "Soil Moisture 8")))
-                # Artificial pause to let ISY catch up
-                
-            self.disco = 1
-        except requests.exceptions.RequestException as e:
-            LOGGER.debug(e)
+            data = self.fetch_devices(deadline)
 
-    def ambient_weather_update(self):
-        api_url = 'https://api.ambientweather.net/v1/devices?applicationKey=' + self.app_key + '&apiKey=' + self.api_key
+            with self.node_queue.batch():
+                for pws in data:
+                    LOGGER.info('Station %s: %s', pws['macAddress'], pws['info']['name'])
+                    self.station_names[pws['macAddress']] = str(pws['info']['name'])
+                    # Through the arbiter like a poll, so a background
+                    # rediscovery never replaces a fresher realtime or LAN reading
+                    reading = Reading.from_dict(pws['lastData'])
+                    self.ingest(pws['macAddress'], reading)
+                    self.queue_station_nodes(pws['macAddress'], reading)
+            with self.dispatch_lock:
+                self.publisher.flush()
 
+            self.disco = 1
+            self.save_cache(force=True)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            LOGGER.error('Discovery failed: %s', e)
+
+    def queue_station_nodes(self, mac, reading):
+        # Queue, in creation order, the station's nodes that do not exist yet;
+        # NodeQueue paces the adds on Polyglot's acks.  Returns the count.
+        pws_address = self.station_address(mac)
+        queued = 0
+        if pws_address not in self.nodes:
+            name = self.station_names.get(mac, mac)
+            queued += self.node_queue.put(PwsNode(self, pws_address, pws_address, name))
+        for group in NODE_GROUPS:
+            for fields, suffix, node_class, name in group:
+                address = pws_address + suffix
+                if address not in self.nodes and all(f in reading for f in fields):
+                    queued += self.node_queue.put(node_class(self, pws_address, address, name))
+        self.fingerprints[mac] = reading.mask
+        return queued
+
+    def rediscover(self):
+        # Incremental discovery from the readings already fetched: only
+        # stations whose set of reported fields changed are re-checked.
+        with self.node_queue.batch():
+            for mac, reading in list(self.last_data.items()):
+                if self.fingerprints.get(mac) == reading.mask:
+                    continue
+                queued = self.queue_station_nodes(mac, reading)
+                if queued:
+                    LOGGER.info('Rediscovery: adding %d new nodes for %s', queued, mac)
+
+    def load_cache(self):
+        try:
+            with open(CACHE_FILE) as f:
+                cache = json.load(f)
+            stations = cache['stations']
+        except (IOError, OSError, ValueError, KeyError) as e:
+            LOGGER.info('No warm start cache: %s', e)
+            return False
+        self.registry.load(cache.get('addresses', {}))
+        with self.node_queue.batch():
+            for mac, station in stations.items():
+                self.station_names[mac] = station['name']
+                reading = self.last_data[mac] = Reading.from_dict(station['lastData'])
+                self.arbiter.accept(mac, 'cache', reading.dateutc)
+                self.queue_station_nodes(mac, reading)
+        LOGGER.info('Warm start from cache: %d stations', len(stations))
+        self.disco = 1
+        return bool(stations)
+
+    def save_cache(self, force=False):
+        # Written to a temp file and renamed so a crash never leaves a torn
+        # file; called by every source's ingest, so one writer at a time.
+        with self.cache_lock:
+            now = time.monotonic()
+            if not force and now - self.cache_saved < CACHE_INTERVAL:
+                return
+            stations = {mac: {'name': self.station_names.get(mac, mac), 'lastData': reading.as_dict()}
+                        for mac, reading in list(self.last_data.items())}
+            tmp = CACHE_FILE + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump({'stations': stations, 'addresses': dict(self.registry.addresses)}, f,
+                              separators=(',', ':'))
+                os.replace(tmp, CACHE_FILE)
+                self.cache_saved = now
+            except (IOError, OSError, TypeError) as e:
+                LOGGER.warning('Could not write cache: %s', e)
+
+    def nodes_added(self):
+        # Publish the readings discovery already fetched to the nodes that
+        # were created after the last poll dispatched them.
+        LOGGER.info('Node creation complete, %d nodes', len(self.nodes))
+        with self.dispatch_lock:
+            for mac, reading in list(self.last_data.items()):
+                self.dispatch(mac, reading)
+            self.publisher.flush()
+
+    def node_started(self, node):
+        # Polyglot starts a node when it acknowledges the add, which can be
+        # after a poll already published to it, and start() overwrites ST.
+        # Forget what was published there and republish the station's
+        # latest reading so nothing is left showing the start value.
+        self.node_queue.acknowledged(node.address)
+        with self.dispatch_lock:
+            self.publisher.forget(node.address)
+            mac = self.registry.owners.get(node.primary)
+            reading = self.last_data.get(mac)
+            if reading is not None:
+                self.dispatch(mac, reading)
+            if mac in self.stale and node.address == node.primary:
+                self.publisher.publish(node, 'ST', 0)
+            self.publisher.flush()
+
+    def ingest(self, mac, last_data, source='poll'):
+        # Record and dispatch one reading if it is newer than the last one
+        # accepted for the station from any source.  lastData dicts are
+        # converted to a Reading here, once, and merged onto the station's
+        # previous Reading.  Accepting, storing and dispatching happen under
+        # one lock, so a reading accepted on one thread can never be
+        # published after a newer one accepted on another.  Returns True
+        # when anything was published.
+        dateutc = last_data.get('dateutc')
+        with self.dispatch_lock:
+            accepted, last = self.arbiter.accept(mac, source, dateutc)
+            if accepted:
+                self.store(mac, last_data, source, dateutc, last)
+            elif not self.fill_missing(mac, last_data, source, dateutc):
+                self.trace('%s %s dateutc %s already seen', mac, source, dateutc)
+                return False
+        self.save_cache()
+        return True
+
+    def store(self, mac, last_data, source, dateutc, last):
+        # An accepted reading; call with dispatch_lock.  History, rolling
+        # metrics and dispatch get the reading as it arrived, last_data the
+        # merged one.
+        reading = last_data if isinstance(last_data, Reading) else Reading.from_dict(last_data)
+        self.latest[mac] = reading
+        if source != 'lan' and dateutc is not None:
+            # Cloud readings carry every field the cloud computes
+            self.filled[mac] = epoch_seconds(dateutc)
+        self.last_data[mac] = reading.merged(self.last_data.get(mac))
+        if self.snapshot is not None:
+            self.snapshot.update(mac)
+        self.trace('%s %s reading at dateutc %s', mac, source, dateutc)
+        if last is not None and dateutc is not None:
+            self.check_gap(mac, last, epoch_seconds(dateutc))
+        self.history.record(mac, reading)
+        derived = self.metrics.update(mac, reading)
+        self.dispatch(mac, reading)
+        for suffix, driver, value in derived:
+            node = self.registry.node(mac, suffix)
+            if node is not None:
+                self.publisher.publish(node, driver, value)
+        node = self.registry.node(mac, '')
+        if node is not None:
+            self.publisher.publish(node, 'GV0', SOURCES.index(source))
+        self.fresh(mac)
+
+    def fill_missing(self, mac, last_data, source, dateutc):
+        # A reading no newer than the last accepted one can still carry
+        # fields that one lacked: LAN uploads have no feels like or dew
+        # point, which only the cloud computes.  Those are merged in and
+        # published from the newest such sample; call with dispatch_lock.
+        latest = self.latest.get(mac)
+        previous = self.last_data.get(mac)
+        if latest is None or previous is None or dateutc is None:
+            return False
+        seen = epoch_seconds(dateutc)
+        if seen <= self.filled.get(mac, 0):
+            return False
+        reading = last_data if isinstance(last_data, Reading) else Reading.from_dict(last_data)
+        missing = reading.missing_from(latest)
+        if missing is None:
+            return False
+        self.filled[mac] = seen
+        self.last_data[mac] = missing.merged(previous)
+        if self.snapshot is not None:
+            self.snapshot.update(mac)
+        self.trace('%s %s dateutc %s fills fields the last reading lacked', mac, source, dateutc)
+        self.dispatch(mac, missing)
+        return True
+
+    def push_gaps(self):
+        # True when a station pushing readings lacks fields that have nodes,
+        # which only a poll can fill in
+        with self.dispatch_lock:
+            for mac, latest in list(self.latest.items()):
+                if not self.arbiter.station_pushing(mac):
+                    continue
+                for i, routes in self.registry.table(mac):
+                    if not latest.mask >> i & 1:
+                        return True
+        return False
+
+    def check_gap(self, mac, last, seen):
+        # Several missed uploads since the last reading: fetch what was missed
+        cadence = self.scheduler.cadence.get(mac, self.scheduler.cadences[0])
+        if seen - last > BACKFILL_MISSED * cadence:
+            self.backfill.request(mac, last, seen)
+
+    def backfill_records(self, mac, records):
+        # The ISY already shows newer readings, so backfilled ones only go
+        # into the history and rolling windows; the derived values are then
+        # recomputed over the filled gap and republished.
+        with self.dispatch_lock:
+            self.history.merge(mac, [Reading.from_dict(r) for r in records])
+            for suffix, driver, value in self.metrics.rebuild(mac, self.history):
+                node = self.registry.node(mac, suffix)
+                if node is not None:
+                    self.publisher.publish(node, driver, value)
+            self.publisher.flush()
+
+    def ambient_weather_update(self, deadline=None):
+        sent = self.publisher.messages
+        with self.timers.time('poll'):
+            self.poll_stations(deadline)
+        self.publish_timings(self.publisher.messages - sent)
+
+    def poll_stations(self, deadline=None):
         try:
-            r = requests.get(api_url)
-            data = r.json()
-            # LOGGER.debug(data)
+            data = self.fetch_devices(deadline)
 
             try:
-                for pws in data:
-                    LOGGER.info(pws['macAddress'])
-                    LOGGER.info(pws['info']['name'])
-                    pws_address = pws['macAddress'].replace(':', '').replace('0', '').lower()
-                    # pws_name = str(pws['info']['name'])
-                    last_data = pws['lastData']
-                    # print(pws_name)
-                    # print(last_data)
-
-                    if pws_address in self.nodes:
-                        if 'battin' in last_data:
-                            naddr = pws_address + "bi"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['battin'])
-                        if 'battout' in last_data:
-                            naddr = pws_address + "bo"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['battout'])
-                        if 'tempf' in last_data:
-                            naddr = pws_address + "to"
-                            self.nodes[naddr].setDriver('ST', last_data['tempf'])
-                        if 'tempinf' in last_data:
-                            naddr = pws_address + "ti"
-                            self.nodes[naddr].setDriver('ST', last_data['tempinf'])
-                        if 'feelsLike' in last_data:
-                            naddr = pws_address + "fl"
-                            self.nodes[naddr].setDriver('ST', last_data['feelsLike'])
-                        if 'feelsLikein' in last_data:
-                            naddr = pws_address + "fli"
-                            self.nodes[naddr].setDriver('ST', last_data['feelsLikein'])
-                        if 'dewPoint' in last_data:
-                            naddr = pws_address + "dp"
-                            self.nodes[naddr].setDriver('ST', last_data['dewPoint'])
-                        if 'dewPointin' in last_data:
-                            naddr = pws_address + "dpi"
-                            self.nodes[naddr].setDriver('ST', last_data['dewPointin'])
-                        if 'humidity' in last_data:
-                            naddr = pws_address + "ho"
-                            self.nodes[naddr].setDriver('ST', last_data['humidity'])
-                        if 'humidityin' in last_data:
-                            naddr = pws_address + "hi"
-                            self.nodes[naddr].setDriver('ST', last_data['humidityin'])
-                        if 'baromabsin' in last_data:
-                            naddr = pws_address + "hg"
-                            self.nodes[naddr].setDriver('ATMPRES', last_data['baromabsin'])
-                        if 'baromrelin' in last_data:
-                            naddr = pws_address + "hg"
-                            self.nodes[naddr].setDriver('ST', last_data['baromrelin'])
-                        if 'dailyrainin' in last_data:
-                            naddr = pws_address + "rd"
-                            self.nodes[naddr].setDriver('ST', last_data['dailyrainin'])
-                        if 'monthlyrainin' in last_data:
-                            naddr = pws_address + "rm"
-                            self.nodes[naddr].setDriver('ST', last_data['monthlyrainin'])
-                        if 'weeklyrainin' in last_data:
-                            naddr = pws_address + "rw"
-                            self.nodes[naddr].setDriver('ST', last_data['weeklyrainin'])
-                        if 'totalrainin' in last_data:
-                            naddr = pws_address + "rt"
-                            self.nodes[naddr].setDriver('ST', last_data['totalrainin'])
-                        if 'yearlyrainin' in last_data:
-                            naddr = pws_address + "ry"
-                            self.nodes[naddr].setDriver('ST', last_data['yearlyrainin'])
-                        if 'eventrainin' in last_data:
-                            naddr = pws_address + "re"
-                            self.nodes[naddr].setDriver('ST', last_data['eventrainin'])
-                        if 'hourlyrainin' in last_data:
-                            naddr = pws_address + "rh"
-                            self.nodes[naddr].setDriver('ST', last_data['hourlyrainin'])
-                        if 'solarradiation' in last_data:
-                            naddr = pws_address + "sol"
-                            lux = self.lux_convert(last_data['solarradiation'])
-                            self.nodes[naddr].setDriver('SOLRAD', last_data['solarradiation'])
-                            self.nodes[naddr].setDriver('ST', lux)
-                        if 'uv' in last_data:
-                            naddr = pws_address + "sol"
-                            self.nodes[naddr].setDriver('UV', last_data['uv'])
-                        if 'winddir' in last_data:
-                            naddr = pws_address + "wnd"
-                            cardinal = self.cardinal_direction(last_data['winddir'])
-                            self.nodes[naddr].setDriver('WINDDIR', last_data['winddir'])
-                            self.nodes[naddr].setDriver('GV0', cardinal)
-                        if 'windspeedmph' in last_data:
-                            naddr = pws_address + "wnd"
-                            self.nodes[naddr].setDriver('ST', last_data['windspeedmph'])
-                        if 'windgustmph' in last_data:
-                            naddr = pws_address + "wnd"
-                            self.nodes[naddr].setDriver('GV1', last_data['windgustmph'])
-                        if 'maxdailygust' in last_data:
-                            naddr = pws_address + "fl"
-                            self.nodes[naddr].setDriver('GV2', last_data['maxdailygust'])
-
-                        # Temperature Data
-                        if 'temp1f' in last_data:
-                            naddr = pws_address + "as1"
-                            self.nodes[naddr].setDriver('ST', last_data['temp1f'])
-                        if 'temp2f' in last_data:
-                            naddr = pws_address + "as2"
-                            self.nodes[naddr].setDriver('ST', last_data['temp2f'])
-                        if 'temp3f' in last_data:
-                            naddr = pws_address + "as3"
-                            self.nodes[naddr].setDriver('ST', last_data['temp3f'])
-                        if 'temp4f' in last_data:
-                            naddr = pws_address + "as4"
-                            self.nodes[naddr].setDriver('ST', last_data['temp4f'])
-                        if 'temp5f' in last_data:
-                            naddr = pws_address + "as5"
-                            self.nodes[naddr].setDriver('ST', last_data['temp5f'])
-                        if 'temp6f' in last_data:
-                            naddr = pws_address + "as6"
-                            self.nodes[naddr].setDriver('ST', last_data['temp6f'])
-                        if 'temp7f' in last_data:
-                            naddr = pws_address + "as7"
-                            self.nodes[naddr].setDriver('ST', last_data['temp7f'])
-                        if 'temp8f' in last_data:
-                            naddr = pws_address + "as8"
-                            self.nodes[naddr].setDriver('ST', last_data['temp8f'])
-
-                        # Humidity Data
-                        if 'humidity1' in last_data:
-                            naddr = pws_address + "as1"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity1'])
-                        if 'humidity2' in last_data:
-                            naddr = pws_address + "as2"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity2'])
-                        if 'humidity3' in last_data:
-                            naddr = pws_address + "as3"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity3'])
-                        if 'humidity4' in last_data:
-                            naddr = pws_address + "as4"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity4'])
-                        if 'humidity5' in last_data:
-                            naddr = pws_address + "as5"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity5'])
-                        if 'humidity6' in last_data:
-                            naddr = pws_address + "as6"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity6'])
-                        if 'humidity7' in last_data:
-                            naddr = pws_address + "as7"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity7'])
-                        if 'humidity8' in last_data:
-                            naddr = pws_address + "as8"
-                            self.nodes[naddr].setDriver('CLIHUM', last_data['humidity8'])
-
-                        # Soil Temperature Data
-                        if 'soiltemp1' in last_data:
-                            naddr = pws_address + "sm1"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp1'])
-                        if 'soiltemp2' in last_data:
-                            naddr = pws_address + "sm2"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp2'])
-                        if 'soiltemp3' in last_data:
-                            naddr = pws_address + "sm3"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp3'])
-                        if 'soiltemp4' in last_data:
-                            naddr = pws_address + "sm4"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp4'])
-                        if 'soiltemp5' in last_data:
-                            naddr = pws_address + "sm5"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp5'])
-                        if 'soiltemp6' in last_data:
-                            naddr = pws_address + "sm6"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp6'])
-                        if 'soiltemp7' in last_data:
-                            naddr = pws_address + "sm7"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp7'])
-                        if 'soiltemp8' in last_data:
-                            naddr = pws_address + "sm8"
-                            self.nodes[naddr].setDriver('SOILT', last_data['soiltemp8'])
-
-                        # Soil Humidity Data
-                        if 'soilhum1' in last_data:
-                            naddr = pws_address + "sm1"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum1'])
-                        if 'soilhum2' in last_data:
-                            naddr = pws_address + "sm2"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum2'])
-                        if 'soilhum3' in last_data:
-                            naddr = pws_address + "sm3"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum3'])
-                        if 'soilhum4' in last_data:
-                            naddr = pws_address + "sm4"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum4'])
-                        if 'soilhum5' in last_data:
-                            naddr = pws_address + "sm5"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum5'])
-                        if 'soilhum6' in last_data:
-                            naddr = pws_address + "sm6"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum6'])
-                        if 'soilhum7' in last_data:
-                            naddr = pws_address + "sm7"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum7'])
-                        if 'soilhum8' in last_data:
-                            naddr = pws_address + "sm8"
-                            self.nodes[naddr].setDriver('ST', last_data['soilhum8'])
-
-                        # Battery / Feels Like / Dew Point have to be handled differently as the
-                        # fields are named the same regardless of being a temp WH31 or TX3102
-                        if 'batt1' in data and 'temp1f' in last_data:
-                            naddr = pws_address + "as1"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt1'])
-                        elif 'batt1' in data and 'soilhum1' in last_data:
-                            naddr = pws_address + "sm1"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt1'])
-                        if 'batt2' in data and 'temp2f' in last_data:
-                            naddr = pws_address + "as2"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt2'])
-                        elif 'batt2' in data and 'soilhum2' in last_data:
-                            naddr = pws_address + "sm2"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt2'])
-                        if 'batt3' in data and 'temp3f' in last_data:
-                            naddr = pws_address + "as3"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt3'])
-                        elif 'batt3' in data and 'soilhum3' in last_data:
-                            naddr = pws_address + "sm3"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt3'])
-                        if 'batt4' in data and 'temp4f' in last_data:
-                            naddr = pws_address + "as4"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt4'])
-                        elif 'batt4' in data and 'soilhum4' in last_data:
-                            naddr = pws_address + "sm4"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt4'])
-                        if 'batt5' in data and 'temp5f' in last_data:
-                            naddr = pws_address + "as5"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt5'])
-                        elif 'batt5' in data and 'soilhum5' in last_data:
-                            naddr = pws_address + "sm5"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt5'])
-                        if 'batt6' in data and 'temp6f' in last_data:
-                            naddr = pws_address + "as6"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt6'])
-                        elif 'batt6' in data and 'soilhum6' in last_data:
-                            naddr = pws_address + "sm6"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt6'])
-                        if 'batt7' in data and 'temp7f' in last_data:
-                            naddr = pws_address + "as7"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt7'])
-                        elif 'batt7' in data and 'soilhum7' in last_data:
-                            naddr = pws_address + "sm7"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt7'])
-                        if 'batt8' in data and 'temp8f' in last_data:
-                            naddr = pws_address + "as8"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt8'])
-                        elif 'batt8' in data and 'soilhum8' in last_data:
-                            naddr = pws_address + "sm8"
-                            self.nodes[naddr].setDriver('BATLVL', last_data['batt8'])
-
-                        # Feels Like Data
-                        if 'feelsLike1' in data and 'temp1f' in last_data:
-                            naddr = pws_address + "as1"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike1'])
-                        elif 'feelsLike1' in data and 'soiltemp1' in last_data:
-                            naddr = pws_address + "sm1"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike1'])
-                        if 'feelsLike2' in data and 'temp2f' in last_data:
-                            naddr = pws_address + "as2"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike2'])
-                        elif 'feelsLike2' in data and 'soiltemp2' in last_data:
-                            naddr = pws_address + "sm2"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike2'])
-                        if 'feelsLike3' in data and 'temp3f' in last_data:
-                            naddr = pws_address + "as3"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike3'])
-                        elif 'feelsLike3' in data and 'soiltemp3' in last_data:
-                            naddr = pws_address + "sm3"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike3'])
-                        if 'feelsLike4' in data and 'temp4f' in last_data:
-                            naddr = pws_address + "as4"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike4'])
-                        elif 'feelsLike4' in data and 'soiltemp4' in last_data:
-                            naddr = pws_address + "sm4"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike4'])
-                        if 'feelsLike5' in data and 'temp5f' in last_data:
-                            naddr = pws_address + "as5"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike5'])
-                        elif 'feelsLike5' in data and 'soiltemp5' in last_data:
-                            naddr = pws_address + "sm5"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike5'])
-                        if 'feelsLike6' in data and 'temp6f' in last_data:
-                            naddr = pws_address + "as6"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike6'])
-                        elif 'feelsLike6' in data and 'soiltemp6' in last_data:
-                            naddr = pws_address + "sm6"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike6'])
-                        if 'feelsLike7' in data and 'temp7f' in last_data:
-                            naddr = pws_address + "as7"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike7'])
-                        elif 'feelsLike7' in data and 'soiltemp7' in last_data:
-                            naddr = pws_address + "sm7"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike7'])
-                        if 'feelsLike8' in data and 'temp8f' in last_data:
-                            naddr = pws_address + "as8"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike8'])
-                        elif 'feelsLike8' in data and 'soiltemp8' in last_data:
-                            naddr = pws_address + "sm8"
-                            self.nodes[naddr].setDriver('GV0', last_data['feelsLike8'])
-
-                        # Dew Point Data
-                        if 'dewPoint1' in data and 'temp1f' in last_data:
-                            naddr = pws_address + "as1"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint1'])
-                        elif 'dewPoint1' in data and 'soiltemp1' in last_data:
-                            naddr = pws_address + "sm1"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint1'])
-                        if 'dewPoint2' in data and 'temp2f' in last_data:
-                            naddr = pws_address + "as2"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint2'])
-                        elif 'dewPoint2' in data and 'soiltemp2' in last_data:
-                            naddr = pws_address + "sm2"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint2'])
-                        if 'dewPoint3' in data and 'temp3f' in last_data:
-                            naddr = pws_address + "as3"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint3'])
-                        elif 'dewPoint3' in data and 'soiltemp3' in last_data:
-                            naddr = pws_address + "sm3"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint3'])
-                        if 'dewPoint4' in data and 'temp4f' in last_data:
-                            naddr = pws_address + "as4"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint4'])
-                        elif 'dewPoint4' in data and 'soiltemp4' in last_data:
-                            naddr = pws_address + "sm4"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint4'])
-                        if 'dewPoint5' in data and 'temp5f' in last_data:
-                            naddr = pws_address + "as5"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint5'])
-                        elif 'dewPoint5' in data and 'soiltemp5' in last_data:
-                            naddr = pws_address + "sm5"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint5'])
-                        if 'dewPoint6' in data and 'temp6f' in last_data:
-                            naddr = pws_address + "as6"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint6'])
-                        elif 'dewPoint6' in data and 'soiltemp6' in last_data:
-                            naddr = pws_address + "sm6"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint6'])
-                        if 'dewPoint7' in data and 'temp7f' in last_data:
-                            naddr = pws_address + "as7"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint7'])
-                        elif 'dewPoint7' in data and 'soiltemp7' in last_data:
-                            naddr = pws_address + "sm7"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint7'])
-                        if 'dewPoint8' in data and 'temp8f' in last_data:
-                            naddr = pws_address + "as8"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint8'])
-                        elif 'dewPoint8' in data and 'soiltemp8' in last_data:
-                            naddr = pws_address + "sm8"
-                            self.nodes[naddr].setDriver('GV1', last_data['dewPoint8'])
+                with self.timers.time('dispatch'):
+                    for i, pws in enumerate(data):
+                        self.station_names[pws['macAddress']] = str(pws['info']['name'])
+                        self.ingest(pws['macAddress'], pws['lastData'])
+                        # Let each raw dict go as soon as it is converted
+                        data[i] = None
+                with self.dispatch_lock, self.timers.time('publish'):
+                    self.publisher.flush()
             except TypeError as e:
-                LOGGER.debug(data)
-                pass
+                self.trace('Unexpected device list: %s', data)
+                self.log.log('bad_devices', logging.WARNING, 'Unexpected device list from the Ambient API: %s', e)
+        except ApiUnavailable as e:
+            LOGGER.debug('Ambient Weather update skipped: %s', e)
         except (requests.exceptions.RequestException, json.decoder.JSONDecodeError) as e:
-            LOGGER.debug(e)
-            pass
+            # Failed probes are expected while the breaker is open
+            self.trace('Ambient Weather update failed: %s', e)
+            if not self.breaker.open:
+                self.log.log('poll_failed', logging.WARNING, 'Ambient Weather update failed: %s', e)
+
+    def set_stale(self, stale):
+        # Called as the circuit breaker opens and closes.  Stations still
+        # pushing LAN or realtime readings are not stale; the others drop
+        # ST to 0 until the API answers or ingest() accepts a reading for
+        # them from any source.  Controller GV3 is set while any is stale.
+        with self.dispatch_lock:
+            if stale:
+                self.stale = set(mac for mac in list(self.registry.addresses)
+                                 if not self.arbiter.station_pushing(mac))
+            else:
+                self.stale = set()
+            self.publisher.publish(self, 'GV3', int(bool(self.stale)))
+            for address, mac in list(self.registry.owners.items()):
+                node = self.nodes.get(address)
+                if isinstance(node, PwsNode):
+                    self.publisher.publish(node, 'ST', 0 if mac in self.stale else 1)
+            self.publisher.flush()
+
+    def fresh(self, mac):
+        # A reading was accepted for a stale station; call with dispatch_lock
+        if mac not in self.stale:
+            return
+        self.stale.discard(mac)
+        node = self.registry.node(mac, '')
+        if node is not None:
+            self.publisher.publish(node, 'ST', 1)
+        if not self.stale:
+            self.publisher.publish(self, 'GV3', 0)
+
+    def publish_timings(self, sent):
+        with self.dispatch_lock:
+            self.publisher.publish(self, 'GV0', round(self.timers.last('poll')))
+            self.publisher.publish(self, 'GV1', round(self.timers.last('fetch')))
+            self.publisher.publish(self, 'GV2', sent)
+            self.publisher.flush()
+
+    def dump_metrics(self, command=None):
+        LOGGER.info('Timing histograms (ms):')
+        for line in self.timers.dump():
+            LOGGER.info(line)
+        LOGGER.info('Ambient API requests: %s', self.limiter.stats())
+        LOGGER.info('Ambient application key waits: %s', self.app_limiter.stats())
+        LOGGER.info('Ambient API cycles: %s', self.worker.stats())
+        LOGGER.info('Ambient API circuit breaker: %s', self.breaker.stats())
+        LOGGER.info('Readings by source: %s', self.arbiter.stats())
+        LOGGER.info('Backfill: %s', self.backfill.stats())
+        if self.lan is not None:
+            LOGGER.info('LAN uploads: %s', self.lan.stats())
+        if self.snapshot is not None:
+            LOGGER.info('Snapshot requests: %s', self.snapshot.stats())
+        LOGGER.info('Driver updates: %d messages, %d suppressed by deadband',
+                    self.publisher.messages, self.publisher.suppressed)
+
+    def dump_trace(self, command=None):
+        LOGGER.info('Debug trace, %d most recent records:', len(self.trace.records))
+        for line in self.trace.dump():
+            LOGGER.info(line)
 
     def delete(self):
         LOGGER.info('Ambient Weather NodeServer:  Deleted')
 
     def stop(self):
+        if self.poll_timer is not None:
+            self.poll_timer.cancel()
+        if self.last_data:
+            self.save_cache(force=True)
+        self.worker.stop()
+        if self.lan is not None:
+            self.lan.stop()
+        if self.snapshot is not None:
+            self.snapshot.stop()
+        self.stop_websocket()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.session.close()
         LOGGER.debug('NodeServer stopped.')
 
     def check_params(self):
         default_api_key = 'YOUR API KEY'
         default_app_key = 'YOUR APP KEY'
 
-        if 'app_key' not in self.polyConfig['customParams']:
-            self.addCustomParam({'app_key': default_app_key})
-            time.sleep(3)
-        if 'api_key' not in self.polyConfig['customParams']:
-            self.addCustomParam({'api_key': default_api_key})
-            time.sleep(3)
-
-        if self.polyConfig['customParams']['app_key'] != default_app_key:
-            self.app_key = self.polyConfig['customParams']['app_key']
-            if self.polyConfig['customParams']['api_key'] != default_api_key:
-                self.api_key = self.polyConfig['customParams']['api_key']
+        # Missing keys are added in one call; polyConfig is refreshed by
+        # Polyglot asynchronously so read from a local copy instead of
+        # sleeping until it catches up.
+        params = dict(self.polyConfig['customParams'])
+        missing = {}
+        if 'app_key' not in params:
+            missing['app_key'] = default_app_key
+        if 'api_key' not in params:
+            missing['api_key'] = default_api_key
+        if missing:
+            self.addCustomParam(missing)
+            params.update(missing)
+
+        if 'deadbands' in params:
+            self.publisher.deadbands.update(DriverPublisher.parse_deadbands(params['deadbands']))
+        if params.get('api_url'):
+            self.api_url = params['api_url'].rstrip('/') + '/v1/devices'
+            LOGGER.info('Using Ambient API at %s', self.api_url)
+        if params.get('realtime_url'):
+            self.realtime_url = params['realtime_url']
+        if params.get('lan_port'):
+            try:
+                self.lan_port = int(params['lan_port'])
+            except ValueError:
+                LOGGER.error('Ignoring bad lan_port: %s', params['lan_port'])
+        if params.get('lan_host'):
+            self.lan_host = params['lan_host'].strip()
+        self.lan_new_stations = str(params.get('lan_new_stations', '')).strip().lower() in ('1', 'true', 'yes')
+        if params.get('snapshot_port'):
+            try:
+                self.snapshot_port = int(params['snapshot_port'])
+            except ValueError:
+                LOGGER.error('Ignoring bad snapshot_port: %s', params['snapshot_port'])
+        if params.get('snapshot_socket'):
+            self.snapshot_socket = params['snapshot_socket']
+
+        if params['app_key'] != default_app_key:
+            if params['api_key'] != default_api_key:
+                self.accounts = self.parse_accounts(params['app_key'], params['api_key'])
+                self.app_key, self.api_key = self.accounts[0]
+                if len(self.accounts) > 1:
+                    LOGGER.info('Using %d Ambient accounts', len(self.accounts))
                 return True
             else:
                 self.addNotice(
@@ -627,6 +2253,16 @@ class Controller(polyinterface.Controller):
                 {'app_key': 'Please set proper APP and API Key in the configuration page, and restart this NodeServer'})
             return False
 
+    @staticmethod
+    def parse_accounts(app_keys, api_keys):
+        # Several accounts are configured as comma separated API keys, with
+        # either one shared APP key or one APP key per API key.
+        app_keys = [k.strip() for k in app_keys.split(',') if k.strip()]
+        api_keys = [k.strip() for k in api_keys.split(',') if k.strip()]
+        if len(app_keys) != len(api_keys):
+            app_keys = app_keys[:1] * len(api_keys)
+        return list(zip(app_keys, api_keys))
+
     def remove_notices_all(self, command):
         LOGGER.info('remove_notices_all:')
         self.removeNoticesAll()
@@ -636,386 +2272,130 @@ class Controller(polyinterface.Controller):
         st = self.poly.installprofile()
         return st
 
-    async def AmbientWeather(self, *args, **kwargs):
-        """Create the aiohttp session and run."""
-        async with ClientSession() as websession:
-            client = Client(self.api_key, self.app_key, websession)
+    def start_websocket(self):
+        if self.ws_thread is not None and self.ws_thread.is_alive():
+            return
+        self.ws_thread = threading.Thread(target=self.websocket_thread, name='AmbientWebsocket')
+        self.ws_thread.daemon = True
+        self.ws_thread.start()
+
+    def stop_websocket(self):
+        loop = self.ws_loop
+        if loop is not None and self.ws_stop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self.ws_stop.set)
+            except RuntimeError:
+                # The loop closed between the check and the call
+                pass
+
+    def set_realtime_url(self):
+        # aioambient has no option for the realtime endpoint; Websocket.connect()
+        # reads the module's WEBSOCKET_API_BASE, so override that.
+        aioambient.websocket.WEBSOCKET_API_BASE = self.realtime_url.rstrip('/')
+        LOGGER.info('Using Ambient realtime API at %s', self.realtime_url)
+
+    def websocket_thread(self):
+        if self.realtime_url:
+            self.set_realtime_url()
+        self.ws_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.ws_loop)
+        try:
+            self.ws_loop.run_until_complete(self.realtime())
+        except Exception as e:
+            LOGGER.error("Websocket worker stopped: %s", e)
+        finally:
+            self.ws_accounts.clear()
+            loop, self.ws_loop = self.ws_loop, None
+            loop.close()
+
+    def ws_connected(self):
+        # True while every account's realtime subscription is up
+        return bool(self.accounts) and len(self.ws_accounts) == len(self.accounts)
+
+    async def realtime(self):
+        self.ws_stop = asyncio.Event()
+        await asyncio.gather(*[self.AmbientWeather(app_key, api_key) for app_key, api_key in self.accounts])
+
+    async def AmbientWeather(self, app_key, api_key):
+        """Run one account's realtime subscription, reconnecting with backoff until stopped."""
+        delay = WS_BACKOFF_MIN
 
         def connect_method():
             LOGGER.info('Client has connected to the websocket')
 
         def subscribed_method(data):
             """Process the data received upon subscribing."""
+            nonlocal delay
             LOGGER.info('Subscription data received')
-            # LOGGER.info('Subscription data received: {0}'.format(data))
+            self.ws_accounts.add(api_key)
+            delay = WS_BACKOFF_MIN
+            for pws in data.get('devices', []):
+                if 'lastData' in pws:
+                    data_method(dict(pws['lastData'], macAddress=pws['macAddress']))
 
         def data_method(data):
-            # print('Data received: {0}'.format(data))
-            pws_address = data['macAddress'].replace(':', '').replace('0', '').lower()
-            if pws_address in self.nodes:
-                if 'battin' in data:
-                    naddr = pws_address + "bi"
-                    self.nodes[naddr].setDriver('BATLVL', data['battin'])
-                if 'battout' in data:
-                    naddr = pws_address + "bo"
-                    self.nodes[naddr].setDriver('BATLVL', data['battout'])
-                if 'tempf' in data:
-                    naddr = pws_address + "to"
-                    self.nodes[naddr].setDriver('ST', data['tempf'])
-                if 'tempinf' in data:
-                    naddr = pws_address + "ti"
-                    self.nodes[naddr].setDriver('ST', data['tempinf'])
-                if 'feelsLike' in data:
-                    naddr = pws_address + "fl"
-                    self.nodes[naddr].setDriver('ST', data['feelsLike'])
-                if 'feelsLikein' in data:
-                    naddr = pws_address + "fli"
-                    self.nodes[naddr].setDriver('ST', data['feelsLikein'])
-                if 'dewPoint' in data:
-                    naddr = pws_address + "dp"
-                    self.nodes[naddr].setDriver('ST', data['dewPoint'])
-                if 'dewPointin' in data:
-                    naddr = pws_address + "dpi"
-                    self.nodes[naddr].setDriver('ST', data['dewPointin'])
-                if 'humidity' in data:
-                    naddr = pws_address + "ho"
-                    self.nodes[naddr].setDriver('ST', data['humidity'])
-                if 'humidityin' in data:
-                    naddr = pws_address + "hi"
-                    self.nodes[naddr].setDriver('ST', data['humidityin'])
-                if 'baromabsin' in data:
-                    naddr = pws_address + "hg"
-                    self.nodes[naddr].setDriver('ATMPRES', data['baromabsin'])
-                if 'baromrelin' in data:
-                    naddr = pws_address + "hg"
-                    self.nodes[naddr].setDriver('ST', data['baromrelin'])
-                if 'dailyrainin' in data:
-                    naddr = pws_address + "rd"
-                    self.nodes[naddr].setDriver('ST', data['dailyrainin'])
-                if 'monthlyrainin' in data:
-                    naddr = pws_address + "rm"
-                    self.nodes[naddr].setDriver('ST', data['monthlyrainin'])
-                if 'weeklyrainin' in data:
-                    naddr = pws_address + "rw"
-                    self.nodes[naddr].setDriver('ST', data['weeklyrainin'])
-                if 'totalrainin' in data:
-                    naddr = pws_address + "rt"
-                    self.nodes[naddr].setDriver('ST', data['totalrainin'])
-                if 'yearlyrainin' in data:
-                    naddr = pws_address + "ry"
-                    self.nodes[naddr].setDriver('ST', data['yearlyrainin'])
-                if 'eventrainin' in data:
-                    naddr = pws_address + "re"
-                    self.nodes[naddr].setDriver('ST', data['eventrainin'])
-                if 'hourlyrainin' in data:
-                    naddr = pws_address + "rh"
-                    self.nodes[naddr].setDriver('ST', data['hourlyrainin'])
-                if 'solarradiation' in data:
-                    naddr = pws_address + "sol"
-                    lux = self.lux_convert(data['solarradiation'])
-                    self.nodes[naddr].setDriver('SOLRAD', data['solarradiation'])
-                    self.nodes[naddr].setDriver('ST', lux)
-                if 'uv' in data:
-                    naddr = pws_address + "sol"
-                    self.nodes[naddr].setDriver('UV', data['uv'])
-                if 'winddir' in data:
-                    naddr = pws_address + "wnd"
-                    cardinal = self.cardinal_direction(data['winddir'])
-                    self.nodes[naddr].setDriver('WINDDIR', data['winddir'])
-                    self.nodes[naddr].setDriver('GV0', cardinal)
-                if 'windspeedmph' in data:
-                    naddr = pws_address + "wnd"
-                    self.nodes[naddr].setDriver('ST', data['windspeedmph'])
-                if 'windgustmph' in data:
-                    naddr = pws_address + "wnd"
-                    self.nodes[naddr].setDriver('GV1', data['windgustmph'])
-                if 'maxdailygust' in data:
-                    naddr = pws_address + "fl"
-                    self.nodes[naddr].setDriver('GV2', data['maxdailygust'])
-
-                # Temperature Data
-                if 'temp1f' in data:
-                    naddr = pws_address + "as1"
-                    self.nodes[naddr].setDriver('ST', data['temp1f'])
-                if 'temp2f' in data:
-                    naddr = pws_address + "as2"
-                    self.nodes[naddr].setDriver('ST', data['temp2f'])
-                if 'temp3f' in data:
-                    naddr = pws_address + "as3"
-                    self.nodes[naddr].setDriver('ST', data['temp3f'])
-                if 'temp4f' in data:
-                    naddr = pws_address + "as4"
-                    self.nodes[naddr].setDriver('ST', data['temp4f'])
-                if 'temp5f' in data:
-                    naddr = pws_address + "as5"
-                    self.nodes[naddr].setDriver('ST', data['temp5f'])
-                if 'temp6f' in data:
-                    naddr = pws_address + "as6"
-                    self.nodes[naddr].setDriver('ST', data['temp6f'])
-                if 'temp7f' in data:
-                    naddr = pws_address + "as7"
-                    self.nodes[naddr].setDriver('ST', data['temp7f'])
-                if 'temp8f' in data:
-                    naddr = pws_address + "as8"
-                    self.nodes[naddr].setDriver('ST', data['temp8f'])
-
-                # Humidity Data
-                if 'humidity1' in data:
-                    naddr = pws_address + "as1"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity1'])
-                if 'humidity2' in data:
-                    naddr = pws_address + "as2"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity2'])
-                if 'humidity3' in data:
-                    naddr = pws_address + "as3"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity3'])
-                if 'humidity4' in data:
-                    naddr = pws_address + "as4"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity4'])
-                if 'humidity5' in data:
-                    naddr = pws_address + "as5"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity5'])
-                if 'humidity6' in data:
-                    naddr = pws_address + "as6"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity6'])
-                if 'humidity7' in data:
-                    naddr = pws_address + "as7"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity7'])
-                if 'humidity8' in data:
-                    naddr = pws_address + "as8"
-                    self.nodes[naddr].setDriver('CLIHUM', data['humidity8'])
-
-                # Soil Temperature Data
-                if 'soiltemp1' in data:
-                    naddr = pws_address + "sm1"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp1'])
-                if 'soiltemp2' in data:
-                    naddr = pws_address + "sm2"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp2'])
-                if 'soiltemp3' in data:
-                    naddr = pws_address + "sm3"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp3'])
-                if 'soiltemp4' in data:
-                    naddr = pws_address + "sm4"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp4'])
-                if 'soiltemp5' in data:
-                    naddr = pws_address + "sm5"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp5'])
-                if 'soiltemp6' in data:
-                    naddr = pws_address + "sm6"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp6'])
-                if 'soiltemp7' in data:
-                    naddr = pws_address + "sm7"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp7'])
-                if 'soiltemp8' in data:
-                    naddr = pws_address + "sm8"
-                    self.nodes[naddr].setDriver('SOILT', data['soiltemp8'])
-
-                # Soil Humidity Data
-                if 'soilhum1' in data:
-                    naddr = pws_address + "sm1"
-                    self.nodes[naddr].setDriver('ST', data['soilhum1'])
-                if 'soilhum2' in data:
-                    naddr = pws_address + "sm2"
-                    self.nodes[naddr].setDriver('ST', data['soilhum2'])
-                if 'soilhum3' in data:
-                    naddr = pws_address + "sm3"
-                    self.nodes[naddr].setDriver('ST', data['soilhum3'])
-                if 'soilhum4' in data:
-                    naddr = pws_address + "sm4"
-                    self.nodes[naddr].setDriver('ST', data['soilhum4'])
-                if 'soilhum5' in data:
-                    naddr = pws_address + "sm5"
-                    self.nodes[naddr].setDriver('ST', data['soilhum5'])
-                if 'soilhum6' in data:
-                    naddr = pws_address + "sm6"
-                    self.nodes[naddr].setDriver('ST', data['soilhum6'])
-                if 'soilhum7' in data:
-                    naddr = pws_address + "sm7"
-                    self.nodes[naddr].setDriver('ST', data['soilhum7'])
-                if 'soilhum8' in data:
-                    naddr = pws_address + "sm8"
-                    self.nodes[naddr].setDriver('ST', data['soilhum8'])
-
-                # Battery / Feels Like / Dew Point have to be handled differently as the
-                # fields are named the same regardless of being a temp WH31 or TX3102
-                if 'batt1' in data and 'temp1f' in data:
-                    naddr = pws_address + "as1"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt1'])
-                elif 'batt1' in data and 'soilhum1' in data:
-                    naddr = pws_address + "sm1"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt1'])
-                if 'batt2' in data and 'temp2f' in data:
-                    naddr = pws_address + "as2"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt2'])
-                elif 'batt2' in data and 'soilhum2' in data:
-                    naddr = pws_address + "sm2"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt2'])
-                if 'batt3' in data and 'temp3f' in data:
-                    naddr = pws_address + "as3"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt3'])
-                elif 'batt3' in data and 'soilhum3' in data:
-                    naddr = pws_address + "sm3"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt3'])
-                if 'batt4' in data and 'temp4f' in data:
-                    naddr = pws_address + "as4"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt4'])
-                elif 'batt4' in data and 'soilhum4' in data:
-                    naddr = pws_address + "sm4"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt4'])
-                if 'batt5' in data and 'temp5f' in data:
-                    naddr = pws_address + "as5"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt5'])
-                elif 'batt5' in data and 'soilhum5' in data:
-                    naddr = pws_address + "sm5"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt5'])
-                if 'batt6' in data and 'temp6f' in data:
-                    naddr = pws_address + "as6"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt6'])
-                elif 'batt6' in data and 'soilhum6' in data:
-                    naddr = pws_address + "sm6"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt6'])
-                if 'batt7' in data and 'temp7f' in data:
-                    naddr = pws_address + "as7"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt7'])
-                elif 'batt7' in data and 'soilhum7' in data:
-                    naddr = pws_address + "sm7"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt7'])
-                if 'batt8' in data and 'temp8f' in data:
-                    naddr = pws_address + "as8"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt8'])
-                elif 'batt8' in data and 'soilhum8' in data:
-                    naddr = pws_address + "sm8"
-                    self.nodes[naddr].setDriver('BATLVL', data['batt8'])
-
-                # Feels Like Data
-                if 'feelsLike1' in data and 'temp1f' in data:
-                    naddr = pws_address + "as1"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike1'])
-                elif 'feelsLike1' in data and 'soiltemp1' in data:
-                    naddr = pws_address + "sm1"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike1'])
-                if 'feelsLike2' in data and 'temp2f' in data:
-                    naddr = pws_address + "as2"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike2'])
-                elif 'feelsLike2' in data and 'soiltemp2' in data:
-                    naddr = pws_address + "sm2"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike2'])
-                if 'feelsLike3' in data and 'temp3f' in data:
-                    naddr = pws_address + "as3"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike3'])
-                elif 'feelsLike3' in data and 'soiltemp3' in data:
-                    naddr = pws_address + "sm3"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike3'])
-                if 'feelsLike4' in data and 'temp4f' in data:
-                    naddr = pws_address + "as4"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike4'])
-                elif 'feelsLike4' in data and 'soiltemp4' in data:
-                    naddr = pws_address + "sm4"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike4'])
-                if 'feelsLike5' in data and 'temp5f' in data:
-                    naddr = pws_address + "as5"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike5'])
-                elif 'feelsLike5' in data and 'soiltemp5' in data:
-                    naddr = pws_address + "sm5"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike5'])
-                if 'feelsLike6' in data and 'temp6f' in data:
-                    naddr = pws_address + "as6"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike6'])
-                elif 'feelsLike6' in data and 'soiltemp6' in data:
-                    naddr = pws_address + "sm6"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike6'])
-                if 'feelsLike7' in data and 'temp7f' in data:
-                    naddr = pws_address + "as7"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike7'])
-                elif 'feelsLike7' in data and 'soiltemp7' in data:
-                    naddr = pws_address + "sm7"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike7'])
-                if 'feelsLike8' in data and 'temp8f' in data:
-                    naddr = pws_address + "as8"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike8'])
-                elif 'feelsLike8' in data and 'soiltemp8' in data:
-                    naddr = pws_address + "sm8"
-                    self.nodes[naddr].setDriver('GV0', data['feelsLike8'])
-
-                # Dew Point Data
-                if 'dewPoint1' in data and 'temp1f' in data:
-                    naddr = pws_address + "as1"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint1'])
-                elif 'dewPoint1' in data and 'soiltemp1' in data:
-                    naddr = pws_address + "sm1"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint1'])
-                if 'dewPoint2' in data and 'temp2f' in data:
-                    naddr = pws_address + "as2"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint2'])
-                elif 'dewPoint2' in data and 'soiltemp2' in data:
-                    naddr = pws_address + "sm2"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint2'])
-                if 'dewPoint3' in data and 'temp3f' in data:
-                    naddr = pws_address + "as3"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint3'])
-                elif 'dewPoint3' in data and 'soiltemp3' in data:
-                    naddr = pws_address + "sm3"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint3'])
-                if 'dewPoint4' in data and 'temp4f' in data:
-                    naddr = pws_address + "as4"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint4'])
-                elif 'dewPoint4' in data and 'soiltemp4' in data:
-                    naddr = pws_address + "sm4"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint4'])
-                if 'dewPoint5' in data and 'temp5f' in data:
-                    naddr = pws_address + "as5"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint5'])
-                elif 'dewPoint5' in data and 'soiltemp5' in data:
-                    naddr = pws_address + "sm5"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint5'])
-                if 'dewPoint6' in data and 'temp6f' in data:
-                    naddr = pws_address + "as6"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint6'])
-                elif 'dewPoint6' in data and 'soiltemp6' in data:
-                    naddr = pws_address + "sm6"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint6'])
-                if 'dewPoint7' in data and 'temp7f' in data:
-                    naddr = pws_address + "as7"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint7'])
-                elif 'dewPoint7' in data and 'soiltemp7' in data:
-                    naddr = pws_address + "sm7"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint7'])
-                if 'dewPoint8' in data and 'temp8f' in data:
-                    naddr = pws_address + "as8"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint8'])
-                elif 'dewPoint8' in data and 'soiltemp8' in data:
-                    naddr = pws_address + "sm8"
-                    self.nodes[naddr].setDriver('GV1', data['dewPoint8'])
-
-        def disconnect_method():
-            """Print a simple "goodbye" message."""
-            LOGGER.info('Client has disconnected from the websocket')
-            LOGGER.info('Attempting to reconnect')
-            client.websocket.connect()
-
-        # Connect to the websocket:
-        client.websocket.on_connect(connect_method)
-        client.websocket.on_subscribed(subscribed_method)
-        client.websocket.on_data(data_method)
-        client.websocket.on_disconnect(disconnect_method)
+            self.station_accounts[data['macAddress']] = (app_key, api_key)
+            if self.ingest(data['macAddress'], data, 'realtime'):
+                with self.dispatch_lock:
+                    self.publisher.flush()
 
-        try:
-            await client.websocket.connect()
-        except WebsocketError as e:
-            LOGGER.error("Websocket Error: %s", e)
-            return
+        while not self.ws_stop.is_set():
+            disconnected = asyncio.Event()
+
+            def disconnect_method():
+                LOGGER.info('Client has disconnected from the websocket, polling until it reconnects')
+                self.ws_accounts.discard(api_key)
+                disconnected.set()
 
-        # At any point, disconnect from the websocket:
-        # await client.websocket.disconnect()
+            websocket = Websocket(app_key, api_key)
+            websocket.on_connect(connect_method)
+            websocket.on_subscribed(subscribed_method)
+            websocket.on_data(data_method)
+            websocket.on_disconnect(disconnect_method)
+
+            try:
+                await websocket.connect()
+                stop = asyncio.ensure_future(self.ws_stop.wait())
+                lost = asyncio.ensure_future(disconnected.wait())
+                await asyncio.wait([stop, lost], return_when=asyncio.FIRST_COMPLETED)
+                stop.cancel()
+                lost.cancel()
+            except WebsocketError as e:
+                LOGGER.error("Websocket Error: %s", e)
+            except Exception as e:
+                # Anything else from aioambient or socket.io: back off and
+                # reconnect rather than leaving realtime mode for good
+                LOGGER.error("Websocket failed: %s", e)
+            finally:
+                self.ws_accounts.discard(api_key)
+                try:
+                    await websocket.disconnect()
+                except Exception:
+                    pass
+
+            if not self.ws_stop.is_set():
+                LOGGER.info('Reconnecting websocket in %d seconds', delay)
+                try:
+                    await asyncio.wait_for(self.ws_stop.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, WS_BACKOFF_MAX)
 
     id = 'controller'
     commands = {
-        'DISCOVER': discover,
+        'DISCOVER': discover_command,
         'UPDATE_PROFILE': update_profile,
-        'REMOVE_NOTICES_ALL': remove_notices_all
+        'REMOVE_NOTICES_ALL': remove_notices_all,
+        'DUMP_METRICS': dump_metrics,
+        'DUMP_TRACE': dump_trace
     }
-    drivers = [{'driver': 'ST', 'value': 1, 'uom': 2}]
+    drivers = [
+        {'driver': 'ST', 'value': 1, 'uom': 2},
+        {'driver': 'GV0', 'value': 0, 'uom': 42},  # Last poll duration
+        {'driver': 'GV1', 'value': 0, 'uom': 42},  # Last fetch duration
+        {'driver': 'GV2', 'value': 0, 'uom': 56},  # Updates sent by last poll
+        {'driver': 'GV3', 'value': 0, 'uom': 2},  # Ambient API down, data stale
+        ]
 
 
 class PwsNode(polyinterface.Node):
@@ -1024,6 +2404,7 @@ class PwsNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1035,7 +2416,8 @@ class PwsNode(polyinterface.Node):
         self.reportDrivers()
 
     drivers = [
-        {'driver': 'ST', 'value': 0, 'uom': 2}
+        {'driver': 'ST', 'value': 0, 'uom': 2},
+        {'driver': 'GV0', 'value': 0, 'uom': 25},  # Source of the latest reading
         ]
 
     id = 'PWS_NODE'
@@ -1050,6 +2432,7 @@ class BatteryInsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1077,6 +2460,7 @@ class BatteryOutsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1104,6 +2488,7 @@ class TempOutsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1131,6 +2516,7 @@ class TempInsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1158,6 +2544,7 @@ class FeelsLikeOutsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1185,6 +2572,7 @@ class FeelsLikeInsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1212,6 +2600,7 @@ class DewPointOutsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1239,6 +2628,7 @@ class DewPointInsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1266,6 +2656,7 @@ class HumidityOutsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1293,6 +2684,7 @@ class HumidityInsideNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1320,6 +2712,7 @@ class PressureNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1334,7 +2727,8 @@ class PressureNode(polyinterface.Node):
         # {'driver': 'ST', 'value': 0, 'uom': 2},
         # {'driver': 'BARPRES', 'value': 0, 'uom': 23},
         {'driver': 'ST', 'value': 0, 'uom': 23},
-        {'driver': 'ATMPRES', 'value': 0, 'uom': 23}
+        {'driver': 'ATMPRES', 'value': 0, 'uom': 23},
+        {'driver': 'GV0', 'value': 0, 'uom': 23},  # 3 Hour Pressure Trend
         ]
 
     id = 'PRESSURE_NODE'
@@ -1349,6 +2743,7 @@ class RainHourNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1362,6 +2757,7 @@ class RainHourNode(polyinterface.Node):
     drivers = [
         {'driver': 'ST', 'value': 0, 'uom': 105},
         # {'driver': 'WVOL', 'value': 0, 'uom': 105},
+        {'driver': 'GV0', 'value': 0, 'uom': 24},  # Rain Rate, 10 minutes
         ]
 
     id = 'RAINHOUR_NODE'
@@ -1376,6 +2772,7 @@ class RainDayNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1403,6 +2800,7 @@ class RainWeekNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1430,6 +2828,7 @@ class RainMonthNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1457,6 +2856,7 @@ class RainYearNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1484,6 +2884,7 @@ class RainTotalNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1511,6 +2912,7 @@ class RainEventNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1538,6 +2940,7 @@ class SolarNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1567,6 +2970,7 @@ class WindNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1584,6 +2988,7 @@ class WindNode(polyinterface.Node):
         {'driver': 'ST', 'value': 0, 'uom': 48},  # Wind Speed
         {'driver': 'GV1', 'value': 0, 'uom': 48},  # Wind Gust
         {'driver': 'GV2', 'value': 0, 'uom': 48},  # Max Wind Gust Daily
+        {'driver': 'GV3', 'value': 0, 'uom': 48},  # Peak Wind Gust, 10 minutes
         ]
 
     id = 'WIND_NODE'
@@ -1599,6 +3004,7 @@ class WH31Node(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1631,6 +3037,7 @@ class WH31SMNode(polyinterface.Node):
 
     def start(self):
         self.setDriver('ST', 1)
+        self.controller.node_started(self)
 
     def setOn(self, command):
         self.setDriver('ST', 1)
@@ -1656,6 +3063,106 @@ class WH31SMNode(polyinterface.Node):
                 }
 
 
+# Nodes created by discover(), in creation order.  A node is added when all
+# of its fields are present in the station's lastData.
+#   (required fields, node suffix, node class, node name)
+STATION_NODES = [
+    (('battin',), 'bi', BatteryInsideNode, 'Battery - Inside'),
+    (('battout',), 'bo', BatteryOutsideNode, 'Battery - Outside'),
+    (('tempf',), 'to', TempOutsideNode, 'Temperature - Outside'),
+    (('tempinf',), 'ti', TempInsideNode, 'Temperature - Inside'),
+    (('feelsLike',), 'fl', FeelsLikeOutsideNode, 'Feels Like - Outside'),
+    (('feelsLikein',), 'fli', FeelsLikeInsideNode, 'Feels Like - Inside'),
+    (('dewPoint',), 'dp', DewPointOutsideNode, 'Dew Point - Outside'),
+    (('dewPointin',), 'dpi', DewPointInsideNode, 'Dew Point - Inside'),
+    (('humidity',), 'ho', HumidityOutsideNode, 'Humidity - Outside'),
+    (('humidityin',), 'hi', HumidityInsideNode, 'Humidity - Inside'),
+    (('baromabsin', 'baromrelin'), 'hg', PressureNode, 'Barometric Pressure'),
+    (('dailyrainin',), 'rd', RainDayNode, 'Rain - Day'),
+    (('monthlyrainin',), 'rm', RainMonthNode, 'Rain - Month'),
+    (('weeklyrainin',), 'rw', RainWeekNode, 'Rain - Week'),
+    (('totalrainin',), 'rt', RainTotalNode, 'Rain - Total'),
+    (('yearlyrainin',), 'ry', RainYearNode, 'Rain - Year'),
+    (('eventrainin',), 're', RainEventNode, 'Rain - Event'),
+    (('hourlyrainin',), 'rh', RainHourNode, 'Rain - Hour'),
+    (('uv', 'solarradiation'), 'sol', SolarNode, 'Solar'),
+    (('winddir',), 'wnd', WindNode, 'Wind'),
+]
+SENSOR_NODES = [
+    (('temp{}f'.format(n),), 'as{}'.format(n), WH31Node, 'Sensor {}'.format(n)) for n in range(1, 9)
+]
+# A soil channel reports soilhum, soiltemp or both; either creates the node.
+SOIL_NODES = [
+    ((field.format(n),), 'sm{}'.format(n), WH31SMNode, 'Soil Moisture {}'.format(n))
+    for n in range(1, 9) for field in ('soilhum{}', 'soiltemp{}')
+]
+NODE_GROUPS = (STATION_NODES, SENSOR_NODES, SOIL_NODES)
+
+
+# Ambient field -> node suffix(es), driver, converter.  When several suffixes
+# are given the value goes to the first one that exists for the station; the
+# numbered batt/feelsLike/dewPoint fields are shared by WH31 and soil sensors.
+#   (field, node suffixes, driver, converter)
+FIELD_MAP = [
+    ('battin', 'bi', 'BATLVL', None),
+    ('battout', 'bo', 'BATLVL', None),
+    ('tempf', 'to', 'ST', None),
+    ('tempinf', 'ti', 'ST', None),
+    ('feelsLike', 'fl', 'ST', None),
+    ('feelsLikein', 'fli', 'ST', None),
+    ('dewPoint', 'dp', 'ST', None),
+    ('dewPointin', 'dpi', 'ST', None),
+    ('humidity', 'ho', 'ST', None),
+    ('humidityin', 'hi', 'ST', None),
+    ('baromabsin', 'hg', 'ATMPRES', None),
+    ('baromrelin', 'hg', 'ST', None),
+    ('dailyrainin', 'rd', 'ST', None),
+    ('monthlyrainin', 'rm', 'ST', None),
+    ('weeklyrainin', 'rw', 'ST', None),
+    ('totalrainin', 'rt', 'ST', None),
+    ('yearlyrainin', 'ry', 'ST', None),
+    ('eventrainin', 're', 'ST', None),
+    ('hourlyrainin', 'rh', 'ST', None),
+    ('solarradiation', 'sol', 'SOLRAD', None),
+    ('solarradiation', 'sol', 'ST', Controller.lux_convert),
+    ('uv', 'sol', 'UV', None),
+    ('winddir', 'wnd', 'WINDDIR', None),
+    ('winddir', 'wnd', 'GV0', Controller.cardinal_direction),
+    ('windspeedmph', 'wnd', 'ST', None),
+    ('windgustmph', 'wnd', 'GV1', None),
+    ('maxdailygust', 'wnd', 'GV2', None),
+]
+for _n in range(1, 9):
+    FIELD_MAP += [
+        ('temp{}f'.format(_n), 'as{}'.format(_n), 'ST', None),
+        ('humidity{}'.format(_n), 'as{}'.format(_n), 'CLIHUM', None),
+        ('soiltemp{}'.format(_n), 'sm{}'.format(_n), 'SOILT', None),
+        ('soilhum{}'.format(_n), 'sm{}'.format(_n), 'ST', None),
+        ('batt{}'.format(_n), ('as{}'.format(_n), 'sm{}'.format(_n)), 'BATLVL', None),
+        ('feelsLike{}'.format(_n), ('as{}'.format(_n), 'sm{}'.format(_n)), 'GV0', None),
+        ('dewPoint{}'.format(_n), ('as{}'.format(_n), 'sm{}'.format(_n)), 'GV1', None),
+    ]
+del _n
+
+
+def compile_field_map(field_map):
+    routes = {}
+    for field, suffixes, driver, convert in field_map:
+        if isinstance(suffixes, str):
+            suffixes = (suffixes,)
+        routes[field] = routes.get(field, ()) + ((tuple(suffixes), driver, convert),)
+    return routes
+
+
+FIELD_ROUTES = compile_field_map(FIELD_MAP)
+
+# Field enum: each field the node server uses has a fixed index into
+# Reading.values and StationHistory columns.
+FIELDS = tuple(sorted(FIELD_ROUTES))
+FIELD_INDEX = dict((field, i) for i, field in enumerate(FIELDS))
+EMPTY_VALUES = array('d', [MISSING]) * len(FIELDS)
+
+
 if __name__ == "__main__":
     try:
         polyglot = polyinterface.Interface('AmbientWeather')
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# In-process stand-in for polyinterface used by the benchmarks.  It keeps
+# the parts of the Node / Controller API the node server uses and counts
+# every addNode, setDriver and message that would go to Polyglot.  As in
+# polyinterface 2.x, reportDrivers() sends one message per driver and a
+# node is only started when Polyglot acknowledges its add.
+import collections
+import logging
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+LOGGER = logging.getLogger('ambientweather-bench')
+
+# Seconds before Polyglot acknowledges an addNode
+ACK_DELAY = 0.002
+
+
+class Counters(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.add_node = 0
+        self.set_driver = 0
+        self.messages = 0
+
+    def snapshot(self):
+        return {'addNode': self.add_node, 'setDriver': self.set_driver, 'messages': self.messages}
+
+
+COUNTERS = Counters()
+
+
+class Node(object):
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.drivers = [dict(d) for d in type(self).drivers]
+
+    def start(self):
+        pass
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        COUNTERS.set_driver += 1
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+                if report:
+                    COUNTERS.messages += 1
+                break
+
+    def getDriver(self, driver):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                return d['value']
+        return None
+
+    def reportDrivers(self):
+        COUNTERS.messages += len(self.drivers)
+
+    def query(self):
+        self.reportDrivers()
+
+
+class Controller(Node):
+    def __init__(self, poly):
+        self.poly = poly
+        self.controller = self
+        self.address = 'controller'
+        self.name = 'Controller'
+        self.primary = self.address
+        self.drivers = [dict(d) for d in type(self).drivers]
+        self.nodes = {}
+        self.nodesAdding = []
+        self.polyConfig = {'customParams': {'app_key': 'bench', 'api_key': 'bench'},
+                           'shortPoll': 60, 'longPoll': 300}
+        self.acks = collections.deque()
+        self.ack_cond = threading.Condition()
+        self.ack_thread = None
+
+    def addNode(self, node, update=False):
+        # Polyglot acknowledges ACK_DELAY later, on its own thread
+        COUNTERS.add_node += 1
+        COUNTERS.messages += 1
+        self.nodes[node.address] = node
+        with self.ack_cond:
+            self.nodesAdding.append(node.address)
+            self.acks.append((time.monotonic() + ACK_DELAY, node))
+            if self.ack_thread is None:
+                self.ack_thread = threading.Thread(target=self.acknowledge, name='FakePolyglotAcks')
+                self.ack_thread.daemon = True
+                self.ack_thread.start()
+            self.ack_cond.notify()
+        return node
+
+    def acknowledge(self):
+        # polyinterface starts the node, then drops it from nodesAdding
+        while True:
+            with self.ack_cond:
+                while not self.acks:
+                    self.ack_cond.wait()
+                due, node = self.acks.popleft()
+            time.sleep(max(0, due - time.monotonic()))
+            node.start()
+            with self.ack_cond:
+                self.nodesAdding.remove(node.address)
+
+    def addCustomParam(self, params):
+        self.polyConfig['customParams'].update(params)
+
+    def addNotice(self, notice):
+        pass
+
+    def removeNoticesAll(self):
+        pass
+
+
+class Interface(object):
+    def __init__(self, name):
+        self.name = name
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def installprofile(self):
+        return True
+
+
+def load_nodeserver():
+    # Import ambientweather-poly.py with this module standing in for
+    # polyinterface.  The file name has a dash so it is loaded by path.
+    sys.modules['polyinterface'] = sys.modules[__name__]
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ambientweather-poly.py')
+    spec = importlib.util.spec_from_file_location('ambientweather_poly', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Replay benchmark for the discovery and poll dispatch path.
+
+Loads recorded /v1/devices payloads (or a synthetic account), runs
+discovery and a series of polls against an in-process fake Polyglot, and
+reports per-poll latency percentiles, messages sent to Polyglot, Python
+heap (tracemalloc) and process RSS, both peak and steady state after the
+last poll.
+
+    python3 bench/replay.py                       # 50 synthetic stations
+    python3 bench/replay.py --stations 1 --polls 500
+    python3 bench/replay.py --payload bench/payloads/devices.json
+    python3 bench/replay.py --no-tracemalloc      # RSS without tracing overhead
+"""
+import argparse
+import copy
+import gc
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_polyinterface
+import stations
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def rss_kib():
+    # Current resident set size; Linux only, None elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def peak_rss_kib():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def recorded_source(path):
+    # Replays the recorded devices, moving dateutc on so every poll is fresh
+    devices = stations.load_devices(path)
+
+    def source():
+        for device in devices:
+            device['lastData']['dateutc'] += 60000
+        return copy.deepcopy(devices)
+    return source
+
+
+def synthetic_source(count):
+    account = stations.synthetic_account(count)
+
+    def source():
+        for station in account:
+            station.advance()
+        return [station.device() for station in account]
+    return source
+
+
+def wait_for_nodes(controller):
+    thread = controller.node_queue.thread
+    if thread is not None:
+        thread.join()
+
+
+def run(source, polls, stream=sys.stdout, trace=True):
+    aw = fake_polyinterface.load_nodeserver()
+    counters = fake_polyinterface.COUNTERS
+    counters.reset()
+    controller = aw.Controller(fake_polyinterface.Interface('AmbientWeather'))
+    controller.check_params()
+    payload = [source()]
+    controller.api_get = lambda *args, **kwargs: payload[0]
+
+    rss_start = rss_kib()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    controller.discover()
+    wait_for_nodes(controller)
+    discover_ms = (time.perf_counter() - started) * 1000
+    discovered = counters.snapshot()
+
+    latencies = []
+    messages = []
+    set_drivers = []
+    for _ in range(polls):
+        payload[0] = source()
+        before = counters.snapshot()
+        gc.disable()
+        started = time.perf_counter()
+        controller.ambient_weather_update()
+        latencies.append((time.perf_counter() - started) * 1000)
+        gc.enable()
+        after = counters.snapshot()
+        messages.append(after['messages'] - before['messages'])
+        set_drivers.append(after['setDriver'] - before['setDriver'])
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    gc.collect()
+    rss_steady = rss_kib()
+
+    stream.write('stations:         {}\n'.format(len(payload[0])))
+    stream.write('nodes:            {}\n'.format(len(controller.nodes)))
+    stream.write('discover:         {:.1f} ms, {} addNode, {} messages\n'.format(
+        discover_ms, discovered['addNode'], discovered['messages']))
+    stream.write('polls:            {}\n'.format(polls))
+    stream.write('poll latency ms:  p50 {:.3f}  p90 {:.3f}  p99 {:.3f}  max {:.3f}\n'.format(
+        percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99), max(latencies)))
+    stream.write('messages/poll:    mean {:.1f}  max {}\n'.format(sum(messages) / float(polls), max(messages)))
+    stream.write('setDriver/poll:   mean {:.1f}  max {}\n'.format(sum(set_drivers) / float(polls), max(set_drivers)))
+    if trace:
+        stream.write('heap:             current {:.0f} KiB  peak {:.0f} KiB\n'.format(current / 1024.0, peak / 1024.0))
+    if rss_steady is not None:
+        stream.write('rss:              start {} KiB  steady {} KiB  peak {} KiB\n'.format(
+            rss_start, rss_steady, max(rss_steady, peak_rss_kib())))
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stations', type=int, default=50, help='synthetic stations (default 50)')
+    parser.add_argument('--payload', help='recorded /v1/devices JSON to replay instead')
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--no-tracemalloc', action='store_true', help='measure RSS without tracing overhead')
+    args = parser.parse_args()
+
+    source = recorded_source(args.payload) if args.payload else synthetic_source(args.stations)
+    # The node server writes its warm-start cache to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ambient-bench-'))
+    run(source, args.polls, trace=not args.no_tracemalloc)
+
+
+if __name__ == '__main__':
+    main()
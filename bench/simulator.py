@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Ambient Weather REST and realtime APIs.
+
+Serves N synthetic stations whose readings drift at their upload cadence,
+and can inject 429 responses, latency and malformed JSON for load and soak
+testing.  Point the node server at it with the custom parameters
+api_url=http://HOST:PORT and, for the realtime socket, realtime_url=
+http://HOST:RT_PORT.
+
+    python3 bench/simulator.py --stations 500 --cadence 60,300
+    python3 bench/simulator.py --rate-429 0.1 --latency-ms 800 --malformed 0.02
+
+REST endpoints:
+    GET /v1/devices                       every station with its lastData
+    GET /v1/devices/<mac>?endDate=&limit= history, newest first
+
+The realtime socket.io server needs python-socketio and aiohttp (both come
+with aioambient) and is enabled with --realtime-port.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stations
+
+# Uploads kept per station for the history endpoint
+HISTORY = 2880
+HISTORY_LIMIT = 288
+
+
+class Account(object):
+    def __init__(self, count, cadences, speed=1.0):
+        now = int(time.time() * 1000)
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.stations = []
+        self.history = {}
+        self.listeners = []
+        for n in range(count):
+            station = stations.Station(n, now, random.Random(n).choice(cadences))
+            self.stations.append(station)
+            self.history[station.mac] = collections.deque([station.last_data()], maxlen=HISTORY)
+        self.by_mac = dict((s.mac, s) for s in self.stations)
+
+    def tick(self):
+        # Upload for every station whose next upload time has passed
+        now = int(time.time() * 1000)
+        uploads = []
+        with self.lock:
+            for station in self.stations:
+                while station.dateutc + station.cadence * 1000 / self.speed <= now:
+                    station.advance()
+                    station.dateutc = min(station.dateutc, now)
+                    record = station.last_data()
+                    self.history[station.mac].appendleft(record)
+                    uploads.append(dict(record, macAddress=station.mac))
+        for listener in self.listeners:
+            for upload in uploads:
+                listener(upload)
+
+    def run(self):
+        while True:
+            self.tick()
+            time.sleep(0.5)
+
+    def devices(self):
+        with self.lock:
+            return [station.device() for station in self.stations]
+
+    def records(self, mac, end_date=None, limit=HISTORY_LIMIT):
+        with self.lock:
+            history = list(self.history.get(mac, ()))
+        if end_date is not None:
+            history = [r for r in history if r['dateutc'] < end_date]
+        return history[:limit]
+
+
+class Faults(object):
+    def __init__(self, rate_429=0.0, retry_after=5, latency_ms=0, malformed=0.0):
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.latency_ms = latency_ms
+        self.malformed = malformed
+        self.counts = collections.Counter()
+
+
+def make_handler(account, faults):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_json(self, status, body, headers=()):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            faults.counts['requests'] += 1
+            if faults.latency_ms:
+                time.sleep(random.uniform(0.5, 1.5) * faults.latency_ms / 1000.0)
+            if 'applicationKey' not in query or 'apiKey' not in query:
+                return self.send_json(401, b'{"error":"applicationKey and apiKey are required"}')
+            if random.random() < faults.rate_429:
+                faults.counts['429'] += 1
+                return self.send_json(429, b'{"error":"above-user-rate-limit"}',
+                                      [('Retry-After', str(faults.retry_after))])
+
+            parts = [unquote(p) for p in url.path.strip('/').split('/')]
+            if parts == ['v1', 'devices']:
+                body = account.devices()
+            elif len(parts) == 3 and parts[:2] == ['v1', 'devices'] and parts[2] in account.by_mac:
+                end_date = query.get('endDate', [None])[0]
+                limit = min(HISTORY_LIMIT, int(query.get('limit', [HISTORY_LIMIT])[0]))
+                body = account.records(parts[2], epoch_ms(end_date), limit)
+            else:
+                return self.send_json(404, b'{"error":"not found"}')
+
+            body = json.dumps(body).encode('utf-8')
+            if random.random() < faults.malformed:
+                faults.counts['malformed'] += 1
+                body = body[:len(body) // 2]
+            self.send_json(200, body)
+
+    return Handler
+
+
+def epoch_ms(value):
+    # endDate may be epoch milliseconds or an ISO date
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(time.mktime(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')) * 1000)
+
+
+def serve_realtime(account, port):
+    # Ambient's realtime API: clients emit 'subscribe' with their apiKeys and
+    # receive 'subscribed' with the device list, then a 'data' event per upload.
+    import asyncio
+    import socketio
+    from aiohttp import web
+
+    sio = socketio.AsyncServer(async_mode='aiohttp', cors_allowed_origins='*')
+    app = web.Application()
+    sio.attach(app)
+    loop = asyncio.new_event_loop()
+    subscribers = set()
+
+    @sio.on('subscribe')
+    async def subscribe(sid, data):
+        subscribers.add(sid)
+        await sio.emit('subscribed', {'devices': account.devices(), 'method': 'subscribe'}, to=sid)
+
+    @sio.on('unsubscribe')
+    async def unsubscribe(sid, data=None):
+        subscribers.discard(sid)
+
+    @sio.event
+    async def disconnect(sid):
+        subscribers.discard(sid)
+
+    def publish(record):
+        for sid in list(subscribers):
+            asyncio.run_coroutine_threadsafe(sio.emit('data', record, to=sid), loop)
+
+    account.listeners.append(publish)
+    asyncio.set_event_loop(loop)
+    web.run_app(app, port=port, print=None, loop=loop, handle_signals=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stations', type=int, default=10)
+    parser.add_argument('--cadence', default='60', help='upload interval(s) in seconds, e.g. 60,300')
+    parser.add_argument('--speed', type=float, default=1.0, help='run station clocks faster than real time')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--realtime-port', type=int, help='also serve the socket.io realtime API')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of requests answered 429')
+    parser.add_argument('--retry-after', type=int, default=5)
+    parser.add_argument('--latency-ms', type=int, default=0, help='mean added response latency')
+    parser.add_argument('--malformed', type=float, default=0.0, help='fraction of truncated JSON bodies')
+    args = parser.parse_args()
+
+    cadences = [int(c) for c in args.cadence.split(',')]
+    account = Account(args.stations, cadences, args.speed)
+    faults = Faults(args.rate_429, args.retry_after, args.latency_ms, args.malformed)
+
+    ticker = threading.Thread(target=account.run, name='uploads')
+    ticker.daemon = True
+    ticker.start()
+    if args.realtime_port:
+        realtime = threading.Thread(target=serve_realtime, args=(account, args.realtime_port), name='realtime')
+        realtime.daemon = True
+        realtime.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(account, faults))
+    sys.stdout.write('Serving {} stations on http://{}:{}/v1/devices\n'.format(args.stations, args.host, args.port))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout.write('requests: {}\n'.format(dict(faults.counts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Synthetic Ambient Weather accounts for benchmarks and soak tests.  Each
+# station reports the full field set (indoor/outdoor, rain, wind, solar,
+# temp1f..temp8f and soil channels 1..8) with values that drift between
+# uploads.
+import json
+import math
+import random
+
+
+def mac_address(n):
+    return '02:AB:{:02X}:{:02X}:{:02X}:{:02X}'.format((n >> 24) & 0xff, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+
+class Station(object):
+    def __init__(self, n, dateutc, cadence=60, seed=None):
+        self.mac = mac_address(n + 1)
+        self.name = 'Station {}'.format(n + 1)
+        self.cadence = cadence
+        self.dateutc = dateutc
+        self.random = random.Random(n if seed is None else seed)
+        self.rain = 0.0
+        self.fields = self.initial()
+
+    def initial(self):
+        r = self.random
+        fields = {
+            'tempinf': 70.0, 'humidityin': 45, 'baromrelin': 30.0, 'baromabsin': 29.1,
+            'tempf': 60.0 + r.uniform(-10, 10), 'battout': 1, 'battin': 1, 'humidity': 60,
+            'winddir': r.randint(0, 359), 'windspeedmph': 3.0, 'windgustmph': 5.0, 'maxdailygust': 10.0,
+            'hourlyrainin': 0.0, 'eventrainin': 0.0, 'dailyrainin': 0.0, 'weeklyrainin': 0.4,
+            'monthlyrainin': 1.2, 'yearlyrainin': 30.0, 'totalrainin': 30.0,
+            'solarradiation': 200.0, 'uv': 2, 'feelsLike': 60.0, 'dewPoint': 50.0,
+            'feelsLikein': 70.0, 'dewPointin': 48.0,
+        }
+        for c in range(1, 9):
+            fields['temp{}f'.format(c)] = 65.0 + r.uniform(-5, 5)
+            fields['humidity{}'.format(c)] = 50
+            fields['soiltemp{}'.format(c)] = 55.0 + r.uniform(-3, 3)
+            fields['soilhum{}'.format(c)] = 35
+            fields['batt{}'.format(c)] = 1
+            fields['feelsLike{}'.format(c)] = 65.0
+            fields['dewPoint{}'.format(c)] = 45.0
+        return fields
+
+    def advance(self):
+        # Move every reading a little, as one upload interval would
+        r = self.random
+        f = self.fields
+        self.dateutc += self.cadence * 1000
+        for key in ('tempinf', 'tempf', 'feelsLike', 'dewPoint', 'feelsLikein', 'dewPointin'):
+            f[key] = round(f[key] + r.uniform(-0.3, 0.3), 1)
+        for c in range(1, 9):
+            for key in ('temp{}f', 'feelsLike{}', 'dewPoint{}', 'soiltemp{}'):
+                key = key.format(c)
+                f[key] = round(f[key] + r.uniform(-0.2, 0.2), 1)
+            for key in ('humidity{}', 'soilhum{}'):
+                key = key.format(c)
+                f[key] = max(0, min(100, f[key] + r.randint(-1, 1)))
+        f['humidity'] = max(0, min(100, f['humidity'] + r.randint(-1, 1)))
+        f['baromrelin'] = round(f['baromrelin'] + r.uniform(-0.005, 0.005), 3)
+        f['baromabsin'] = round(f['baromrelin'] - 0.87, 3)
+        f['winddir'] = (f['winddir'] + r.randint(-20, 20)) % 360
+        f['windspeedmph'] = round(max(0.0, f['windspeedmph'] + r.uniform(-1, 1)), 1)
+        f['windgustmph'] = round(f['windspeedmph'] + abs(r.gauss(0, 2)), 1)
+        f['maxdailygust'] = max(f['maxdailygust'], f['windgustmph'])
+        f['solarradiation'] = round(max(0.0, 400 * math.sin(self.dateutc / 86400000.0 * math.pi) + r.uniform(-20, 20)), 2)
+        f['uv'] = int(f['solarradiation'] // 100)
+        if r.random() < 0.05:
+            self.rain = round(r.uniform(0.01, 0.05), 2)
+        else:
+            self.rain = 0.0
+        for key in ('eventrainin', 'dailyrainin', 'weeklyrainin', 'monthlyrainin', 'yearlyrainin', 'totalrainin'):
+            f[key] = round(f[key] + self.rain, 3)
+        f['hourlyrainin'] = round(self.rain * 60.0 * 60 / self.cadence / 60, 2)
+
+    def last_data(self):
+        data = dict(self.fields)
+        data['dateutc'] = self.dateutc
+        return data
+
+    def device(self):
+        return {'macAddress': self.mac, 'info': {'name': self.name}, 'lastData': self.last_data()}
+
+
+def synthetic_account(stations, dateutc=1633536000000, cadence=60):
+    return [Station(n, dateutc, cadence) for n in range(stations)]
+
+
+def load_devices(path):
+    with open(path) as f:
+        return json.load(f)
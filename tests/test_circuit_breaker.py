@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# The circuit breaker against a local server answering every request with
+# a fixed status, through the real requests session and urllib3 retries.
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+import fake_polyinterface
+
+aw = fake_polyinterface.load_nodeserver()
+
+
+def status_server(status):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_GET(self):
+            body = b'{"error":"status"}'
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def controller(self, status):
+        server = status_server(status)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # The node server writes its warm-start cache to the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tempfile.mkdtemp(prefix='ambient-test-'))
+        # One urllib3 retry keeps the test quick; the session is otherwise
+        # the one the node server builds.
+        retries, aw.HTTP_RETRIES = aw.HTTP_RETRIES, 1
+        try:
+            controller = aw.Controller(fake_polyinterface.Interface('AmbientWeather'))
+        finally:
+            aw.HTTP_RETRIES = retries
+        controller.polyConfig['customParams']['api_url'] = 'http://127.0.0.1:{}'.format(server.server_port)
+        controller.check_params()
+        controller.limiter = aw.RateLimiter(rate=1000)
+        controller.app_limiter = aw.RateLimiter(rate=1000)
+        return controller
+
+    def test_server_errors_open_breaker_after_retries(self):
+        controller = self.controller(502)
+        for _ in range(aw.BREAKER_FAILURES):
+            with self.assertRaises(aw.requests.exceptions.HTTPError):
+                controller.api_get()
+        self.assertEqual(controller.breaker.failed, aw.BREAKER_FAILURES)
+        self.assertTrue(controller.breaker.open)
+        with self.assertRaises(aw.ApiUnavailable):
+            controller.api_get()
+
+    def test_rejected_key_does_not_open_breaker(self):
+        controller = self.controller(401)
+        for _ in range(aw.BREAKER_FAILURES + 1):
+            with self.assertRaises(aw.requests.exceptions.HTTPError):
+                controller.api_get()
+        self.assertEqual(controller.breaker.failed, 0)
+        self.assertFalse(controller.breaker.open)
+
+
+if __name__ == '__main__':
+    unittest.main()
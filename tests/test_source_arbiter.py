@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Readings from the REST poll and LAN uploads for one station, through
+# LanReceiver parsing, the SourceArbiter and the controller's merge.
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+import fake_polyinterface
+
+aw = fake_polyinterface.load_nodeserver()
+
+MAC = '00:0E:C6:20:0F:7B'
+# 2021-10-06 16:00:00 UTC
+T0 = 1633536000000
+CLOUD = {'dateutc': T0, 'tempf': 70.0, 'humidity': 50, 'feelsLike': 70.5, 'dewPoint': 50.1,
+         'tempinf': 72.0, 'humidityin': 40, 'feelsLikein': 71.0, 'dewPointin': 46.0,
+         'baromrelin': 29.92, 'baromabsin': 29.1, 'lastRain': '2021-10-05T12:00:00.000Z'}
+
+
+def lan_params(minute, **fields):
+    params = {'PASSKEY': [MAC], 'stationtype': ['AMBWeatherV4.3.0'],
+              'dateutc': ['2021-10-06 16:{:02d}:00'.format(minute)],
+              'tempf': ['71.0'], 'humidity': ['51'], 'tempinf': ['72.5'], 'humidityin': ['41'],
+              'baromrelin': ['29.93'], 'baromabsin': ['29.11']}
+    for field, value in fields.items():
+        params[field] = [value]
+    return params
+
+
+class SourceArbiterTest(unittest.TestCase):
+    def setUp(self):
+        # The node server writes its warm-start cache to the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tempfile.mkdtemp(prefix='ambient-test-'))
+        controller = aw.Controller(fake_polyinterface.Interface('AmbientWeather'))
+        controller.check_params()
+        self.devices = [{'macAddress': MAC, 'info': {'name': 'Backyard'}, 'lastData': dict(CLOUD)}]
+        controller.api_get = lambda *args, **kwargs: self.devices
+        controller.discover()
+        # The node queue thread ends once every add is acknowledged
+        thread = controller.node_queue.thread
+        if thread is not None:
+            thread.join(10)
+        self.controller = controller
+        self.lan = aw.LanReceiver(controller, 0)
+
+    def node(self, suffix):
+        return self.controller.registry.node(MAC, suffix)
+
+    def poll(self, **fields):
+        self.devices = [{'macAddress': MAC, 'info': {'name': 'Backyard'}, 'lastData': dict(CLOUD, **fields)}]
+        self.controller.poll_stations()
+
+    def test_lan_reading_parses_upload(self):
+        reading = aw.LanReceiver.reading(lan_params(1, wh65batt='1'))
+        self.assertEqual(reading['dateutc'], T0 + 60000)
+        self.assertEqual(reading['humidity'], 51)
+        self.assertEqual(reading['tempf'], 71.0)
+        self.assertEqual(reading['battout'], 0)
+        self.assertNotIn('stationtype', reading)
+        self.assertNotIn('PASSKEY', reading)
+
+    def test_lan_upload_keeps_fields_it_does_not_carry(self):
+        self.assertTrue(self.lan.upload(lan_params(1)))
+        last_data = self.controller.last_data[MAC].as_dict()
+        self.assertEqual(last_data['tempf'], 71)
+        self.assertEqual(last_data['feelsLike'], 70.5)
+        self.assertEqual(last_data['dewPointin'], 46.0)
+        self.assertEqual(last_data['lastRain'], CLOUD['lastRain'])
+        self.assertEqual(last_data['dateutc'], T0 + 60000)
+
+    def test_cloud_poll_fills_fields_lan_uploads_lack(self):
+        for minute in (1, 2, 3):
+            self.assertTrue(self.lan.upload(lan_params(minute)))
+        self.assertTrue(self.controller.push_gaps())
+        # The cloud's copy of the last LAN sample, with its computed fields
+        self.poll(dateutc=T0 + 180000, tempf=71.0, feelsLike=99.9)
+        self.assertEqual(self.node('fl').getDriver('ST'), 99.9)
+        last_data = self.controller.last_data[MAC].as_dict()
+        for field in CLOUD:
+            self.assertIn(field, last_data)
+        self.assertEqual(last_data['feelsLike'], 99.9)
+        self.assertEqual(last_data['dateutc'], T0 + 180000)
+
+    def test_older_fill_does_not_replace_newer(self):
+        for minute in (1, 2, 3):
+            self.lan.upload(lan_params(minute))
+        self.poll(dateutc=T0 + 180000, feelsLike=99.9)
+        self.poll(dateutc=T0 + 120000, feelsLike=10.0)
+        self.assertEqual(self.node('fl').getDriver('ST'), 99.9)
+        self.assertEqual(self.controller.last_data[MAC].get('feelsLike'), 99.9)
+
+    def test_stale_reading_with_nothing_new_is_dropped(self):
+        self.poll(dateutc=T0 + 60000, tempf=80.0)
+        self.lan.upload(lan_params(1, tempf='81.0'))
+        self.assertEqual(self.node('to').getDriver('ST'), 80.0)
+        self.assertEqual(self.controller.arbiter.stats()['lan'], {'duplicate': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()